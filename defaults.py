@@ -13,4 +13,29 @@ BRIGHTNESS_DEFAULT = 1
 GRAYSCALE_DEFAULT = False
 INVERT_DEFAULT = False
 FOUR_COLOR_DEFAULT = False
-SATURATION_DEFAULT = 1
\ No newline at end of file
+SATURATION_DEFAULT = 1
+HUE_METHOD = 'hsv'
+BLUR_METHOD = 'auto'
+QUANTIZE_METHOD = 'median-cut'
+QUANTIZE_DITHER = False
+
+# Number of processes exporting images in Multi Image Mode, None uses every CPU
+EXPORT_WORKERS = None
+
+# Memory budget for the cached intermediate results of preview renders
+STAGE_CACHE_BYTES = 256 * 1024 * 1024
+
+# On-disk cache of preview proxies, reused across sessions
+THUMBNAIL_CACHE_DIR = '~/.cache/MultiImageEditor/thumbnails'
+THUMBNAIL_CACHE_BYTES = 1024 * 1024 * 1024
+
+# Memory budget for the decoded preview proxies of the open image's neighbours
+PREFETCH_CACHE_BYTES = 128 * 1024 * 1024
+
+# Images with at least this many pixels are exported tile by tile, with tiles
+# of TILE_SIZE x TILE_SIZE pixels, to bound memory use
+TILED_MIN_PIXELS = 64 * 1000 * 1000
+TILE_SIZE = 1024
+
+# Delay after the last window resize event before the preview is redrawn
+RESIZE_DEBOUNCE_MS = 40
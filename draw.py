@@ -6,7 +6,15 @@ from defaults import *
 from tkwidgets import *
 import menu
 from tools.image_editor import *
-from multiprocessing import Process, cpu_count
+from tools.recipe import EditRecipe
+from tools.instrumentation import format_timings
+from tools.render_scheduler import RenderScheduler
+from tools.cache import ImageLRU
+from tools.pyramid import DisplayPyramid
+from tools.thumbnail_cache import ThumbnailCache
+from tools.scanner import DirectoryScanner
+from tools.prefetch import ProxyPrefetcher
+from tools.batch import iter_export_images, iter_image_paths, render_export, save_image
 import os
 
 image_names = []
@@ -19,6 +27,15 @@ class MainWindow(ctk.CTk):
 		self.geometry('1280x800+50+50')
 		self.title('Multi Image Editor')
 		self.DefaultImageEffects()
+		self.render_scheduler = RenderScheduler(self, on_done=self.ShowEditedImage)
+		self.stage_cache = ImageLRU(STAGE_CACHE_BYTES)
+		self.thumbnail_cache = ThumbnailCache(
+			os.path.expanduser(THUMBNAIL_CACHE_DIR), THUMBNAIL_CACHE_BYTES
+		)
+		self.prefetcher = ProxyPrefetcher(self.thumbnail_cache.load_proxy, PREFETCH_CACHE_BYTES)
+		self.image_index = None # position of the open image in image_names, in Multi Image Mode
+		self.batch_navigator = None
+		self.directory_scanner = None
 
 		# Window Layout
 		self.rowconfigure(0, weight=1)
@@ -35,18 +52,16 @@ class MainWindow(ctk.CTk):
 			edit_menu.grid_forget()
 			self.image_imported = ImportImageWithDialog(self, importer=self.ImportImage)
 		elif menu.editing_mode.get() == "Multi Image Mode":
-			self.processes = []
 			edit_menu.grid_forget()
 			self.image_imported = ImportImageDirectoryWithDialog(self, importer=self.ImportImageDir)
 
+			# Wait for the first image found by the folder scan, the others
+			# keep streaming into image_names while editing
 			self.wait_variable(self.wait_img_names)
 			self.images_directory = self.image_imported.filepath
 
-			for img_name in image_names:
-				self.processes.append(Multi(img_name, self.images_directory))
-			for process in self.processes:
-				process.DefaultImageEffects()
-
+			# Images are only opened when exporting, one batch at a time
+			self.image_index = 0
 			self.image_imported = self.ImportImage(os.path.join(self.images_directory, image_names[0]))
 
 		self.mainloop()
@@ -84,37 +99,65 @@ class MainWindow(ctk.CTk):
 			attribute.trace('w', self.EditImageEffects)
 
 	def EditImageEffects(self, *args):
-		self.image = self.image_og
-		# Edit the image the values from the GUI sliders and buttons
-		editor = ImageEditor(self.image)
-
-		editor.rotation(self.image_position["rotation"].get())
-		editor.zoom(self.image_position["zoom"].get())
-		editor.flip(self.image_position["flip"].get())
-		editor.brightness(self.image_filters["brightness"].get())
-		editor.saturation(self.image_filters["saturation"].get())
-		editor.grayscale(self.image_filters["grayscale"].get())
-
-		try:
-			editor.color_invert(self.image_filters["invert"].get())
-		except:
+		# Preview the edits on the downscaled proxy, the original is only
+		# rendered at full resolution on export
+		if self.image_proxy is None:
+			image, scale = self.image_og, 1.0
+		else:
+			image, scale = self.image_proxy, self.proxy_scale
+
+		# Read the GUI values here, the render itself runs on a worker thread
+		path, recipe = self.image_path, self.GetRecipe()
+		self.render_scheduler.request(
+			lambda is_cancelled: ((path, recipe), self.ApplyImageEffects(
+				image, recipe, scale, is_cancelled, cache=self.stage_cache, source_key=path
+			))
+		)
+
+	def ShowEditedImage(self, render):
+		source, editor = render
+		if editor.failed_stages:
 			tkinter.messagebox.showerror("Invalid operation", "Cannot apply inversion to image filetype.")
 
-		editor.four_color_filter(self.image_filters["4-color"].get())
-		editor.blur(self.image_effects["blur"].get())
-		editor.contrast(self.image_effects["contrast"].get())
-		editor.hue(self.image_effects["hue"].get())
+		# With instrumentation enabled, show the stage timings of the render
+		if editor.stage_timings:
+			self.title('Multi Image Editor - ' + format_timings(editor.stage_timings))
 
 		# When edits are done, display the resulting image
 		self.image = editor.get_image_output
+		self.image_source = source # file and edits the displayed image was rendered from
+		self.display_pyramid = DisplayPyramid(self.image)
 		self.DisplayImage()
 
+	def GetRecipe(self):
+		# Snapshot the values of the GUI sliders and buttons
+		return EditRecipe.from_variables(self.image_position, self.image_filters, self.image_effects)
+
+	def GetPaletteSource(self):
+		# Colors are extracted from the edited preview, cached per file and
+		# edits it was rendered from, which may lag behind the GUI values
+		return self.image_source, self.image
+
+	def ApplyImageEffects(self, image, recipe, scale=1.0, is_cancelled=None, cache=None, source_key=None):
+		# Edit the image with the values from the GUI sliders and buttons
+		editor = ImageEditor(image, scale, cache, source_key=source_key)
+		editor.apply(recipe, is_cancelled)
+		return editor
+
 	def onExit(self):
 		self.quit()
 
 	def ImportImage(self, path, isMaster=False):
+		# Image.open only reads the header, pixels are decoded on export
+		self.image_path = path
 		self.image_og = Image.open(path)
 		self.image = self.image_og # copy of image to revert back to original
+		self.image_source = (path, EditRecipe())
+		self.display_pyramid = DisplayPyramid(self.image)
+		self.resize_job = None
+		self.image_proxy = None # downscaled copy of the original used for previews
+		self.proxy_scale = 1.0
+		self.stage_cache.clear()
 		self.image_tk = PhotoImage(self.image)
 		self.image_aspect_ratio = self.image.size[0] / self.image.size[1]
 
@@ -123,28 +166,64 @@ class MainWindow(ctk.CTk):
 
 		self.image_output = ShowImage(self, resizer=self.ResizeImage)
 		self.close_button = CloseImageViewerButton(self, closer=self.CloseEditor)
+		if self.image_index is not None:
+			self.batch_navigator = BatchNavigator(self, selector=self.ShowBatchImage)
+			self.batch_navigator.Show(self.image_index, len(image_names))
 
 		self.effect_menu = menu.Menu(
 			self,
 			self.image_position,
 			self.image_filters,
 			self.image_effects,
-			self.image,
+			self.GetPaletteSource,
 			self.ExportImage if menu.editing_mode.get() == "Single Image Mode" else self.ExportImages,
 		)
 
 	def ImportImageDir(self, dirpath):
-		global image_names
-		image_names = [img_name for img_name in os.listdir(dirpath) if img_name.endswith(('.png', '.jpeg', '.jpg'))]
-		self.wait_img_names.set(False)
+		# The folder is listed on a worker thread, so that large folders
+		# don't freeze the window
+		if self.directory_scanner is not None:
+			self.directory_scanner.cancel()
+		image_names.clear()
+		self.directory_scanner = DirectoryScanner(self, on_found=self.AddImageNames, on_done=self.ScanDone)
+		self.directory_scanner.start(dirpath)
+
+	def AddImageNames(self, paths):
+		image_names.extend(os.path.basename(path) for path in paths)
+		if self.wait_img_names.get():
+			self.wait_img_names.set(False)
+		if self.batch_navigator is not None:
+			self.batch_navigator.Show(self.image_index, len(image_names))
+
+	def ScanDone(self, error):
+		if error is not None or not image_names:
+			tkinter.messagebox.showerror(
+				"Invalid folder", str(error) if error is not None else "No images found in the folder."
+			)
+
+	def ShowBatchImage(self, index):
+		# Preview another image of the batch with the same edits. Its proxy
+		# is usually prefetched, and the stage cache keeps the renders of
+		# the images visited before, so only missing stages are computed.
+		if not 0 <= index < len(image_names):
+			self.batch_navigator.Show(self.image_index, len(image_names))
+			return
+
+		self.image_index = index
+		self.image_path = os.path.join(self.images_directory, image_names[index])
+		self.image_og = Image.open(self.image_path)
+		self.image_proxy = None
+		self.proxy_scale = 1.0
+		self.image_aspect_ratio = self.image_og.size[0] / self.image_og.size[1]
+		self.batch_navigator.Show(index, len(image_names))
+		self.ApplyResize()
 
 	def DisplayImage(self):
 		self.image_output.delete('all')
-		image_resized = self.image.resize(
-			(self.image_width, self.image_height)
+		# Resampled from the nearest pyramid level, and reused for repeated sizes
+		self.image_tk = self.display_pyramid.photo(
+			(self.image_width, self.image_height), ImageTk.PhotoImage
 		)
-
-		self.image_tk = ImageTk.PhotoImage(image_resized)
 		self.image_output.create_image(
 			0.5 * self.width,
 			0.5 * self.height,
@@ -153,8 +232,16 @@ class MainWindow(ctk.CTk):
 		)
 
 	def ResizeImage(self, event):
-		self.height = event.height
-		self.width = event.width
+		# Dragging the window edge sends bursts of <Configure> events,
+		# only the last one of a burst is handled
+		self.canvas_size = (event.width, event.height)
+		if self.resize_job is not None:
+			self.after_cancel(self.resize_job)
+		self.resize_job = self.after(RESIZE_DEBOUNCE_MS, self.ApplyResize)
+
+	def ApplyResize(self):
+		self.resize_job = None
+		self.width, self.height = self.canvas_size
 		aspect_ratio = self.width / self.height
 
 		if aspect_ratio > self.image_aspect_ratio:   # Canvas is wider than image
@@ -164,24 +251,59 @@ class MainWindow(ctk.CTk):
 			self.image_width = int(self.width)
 			self.image_height = int(self.image_width / self.image_aspect_ratio)
 
-		self.DisplayImage()
+		# Only rebuild the preview proxy when the canvas outgrows it
+		if self.UpdateProxy():
+			self.EditImageEffects()
+		else:
+			self.DisplayImage()
+
+	def UpdateProxy(self):
+		if self.image_proxy is not None:
+			covers_canvas = (
+				self.image_proxy.size[0] >= self.image_width and
+				self.image_proxy.size[1] >= self.image_height
+			)
+			if covers_canvas or self.proxy_scale == 1.0:
+				return False
+
+		# Decode the file again at reduced size, instead of the full original,
+		# or reuse the proxy prefetched or cached by a previous session
+		self.image_proxy, self.proxy_scale = self.prefetcher.get(
+			self.image_path, (self.image_width, self.image_height)
+		)
+		self.PrefetchNeighbours()
+		return True
+
+	def PrefetchNeighbours(self):
+		# Decode the next and previous images of the batch ahead of time. A
+		# proxy covering the fitted size of this image also covers theirs,
+		# whatever their aspect ratio, as they fit in the same canvas
+		if self.image_index is None:
+			return
+		neighbours = [
+			os.path.join(self.images_directory, image_names[index])
+			for index in (self.image_index + 1, self.image_index - 1)
+			if 0 <= index < len(image_names)
+		]
+		self.prefetcher.prefetch(neighbours, (self.image_width, self.image_height))
 
 	def CloseEditor(self):
 		self.image_output.grid_forget()
 		self.close_button.place_forget()
+		if self.batch_navigator is not None:
+			self.batch_navigator.place_forget()
 		self.effect_menu.grid_forget()
 		self.effect_menu.pack_forget()
 		self.image_imported = ImportImageWithDialog(parent=self, importer=self.ImportImage)
 
 	def ExportImage(self, filename, extension, output_path):
 		export_dir = "{}/{}.{}".format(output_path, filename, extension)
-		IS_JPG = self.image.format and self.image.format.lower() in ('jpeg', 'jpg')
-		if IS_JPG:
-			quality='keep'
-		else:
-			quality=100
+		# Rendered like the headless exports, e.g. tile by tile for very large images
+		edited, failed_stages, _ = render_export(self.image_og, self.GetRecipe())
+		if failed_stages:
+			tkinter.messagebox.showerror("Invalid operation", "Cannot apply inversion to image filetype.")
 
-		self.image.save(export_dir, quality=quality, optimize=False)
+		save_image(edited, export_dir)
 
 		if menu.editing_mode.get() == "Single Image Mode":
 			tkinter.messagebox.showinfo(
@@ -189,72 +311,33 @@ class MainWindow(ctk.CTk):
 			)
 
 	def ExportImages(self, output_path):
-		export_info = self.processes[0].image_location
-		self.ExportImage(export_info[1], export_info[2], output_path)
-		effects = [self.image_position, self.image_effects, self.image_filters]
-
-		
-
-		for process in self.processes:
-			process.EditImageEffects(effects)
-			process.ExportImage(output_path)
+		# The folder is enumerated lazily and streamed through the worker
+		# processes, so only a bounded number of images are open at once.
+		# Images already exported with the same recipe are skipped.
+		paths = iter_image_paths(self.images_directory)
+		results = iter_export_images(paths, output_path, self.GetRecipe(), EXPORT_WORKERS)
+
+		exported, skipped, failed = 0, 0, []
+		for result in results:
+			skipped += result.skipped
+			exported += result.output is not None and not result.skipped
+			if result.error:
+				failed.append(result)
+
+		if failed:
+			tkinter.messagebox.showerror(
+				title='Export errors',
+				message='\n'.join(
+					'{}: {}'.format(os.path.basename(result.source), result.error)
+					for result in failed[:10]
+				),
+			)
 
 		tkinter.messagebox.showinfo(
-			title='Done', message='Successfully exported {} image files.'.format(len(self.processes))
-		)	
-
-
-# class for editing multiple images
-class Multi(MainWindow):
-	def __init__(self, img_name, directory):
-		self.ImportImage(os.path.join(directory, img_name))
-
-	def ImportImage(self, path):
-		self.image_location = list(os.path.split(path))
-		name, extension = map(str, self.image_location[1].split('.'))
-		self.image_location[1] = name
-		self.image_location.append(extension)
-
-		self.image_og = Image.open(path)
-		self.image_aspect_ratio = self.image_og.size[0] / self.image_og.size[1]
-
-	def EditImageEffects(self, effects, *args):
-		self.image = self.image_og
-		# Edit the image the values from the GUI sliders and buttons
-		editor = ImageEditor(self.image)
-
-		image_position, image_effects, image_filters = effects[0], effects[1], effects[2]
-
-		editor.rotation(image_position["rotation"].get())
-		editor.zoom(image_position["zoom"].get())
-		editor.flip(image_position["flip"].get())
-		editor.brightness(image_filters["brightness"].get())
-		editor.saturation(image_filters["saturation"].get())
-		editor.grayscale(image_filters["grayscale"].get())
-
-		try:
-			editor.color_invert(image_filters["invert"].get())
-		except:
-			tkinter.messagebox.showerror("Invalid operation", "Cannot apply inversion to image filetype.")
-
-		editor.four_color_filter(image_filters["4-color"].get())
-		editor.blur(image_effects["blur"].get())
-		editor.contrast(image_effects["contrast"].get())
-		editor.hue(image_effects["hue"].get())
-
-		# When edits are done, display the resulting image
-		self.image = editor.get_image_output
-
-	def ExportImage(self, output_path):
-		_, filename, extension = map(str, self.image_location)
-		export_dir = "{}/{}.{}".format(output_path, filename, extension)
-		IS_JPG = self.image.format and self.image.format.lower() in ('jpeg', 'jpg')
-		if IS_JPG:
-			quality='keep'
-		else:
-			quality=100
-
-		self.image.save(export_dir, quality=quality, optimize=False)	
+			title='Done', message='Successfully exported {} image files, {} already up to date.'.format(
+				exported, skipped
+			)
+		)
 
 if __name__ == '__main__':
 	MainWindow()
\ No newline at end of file
@@ -1,6 +1,6 @@
 import customtkinter as ctk
 from PIL.Image import Image
-from typing import Any, Callable
+from typing import Any, Callable, Hashable
 from panel import *
 from defaults import *
 
@@ -8,7 +8,7 @@ editing_mode = None
 
 class Menu(ctk.CTkTabview):
     def __init__(self, parent: ctk.CTk, pos_vars: dict[Any], color_vars: dict[Any],
-        effect_vars: dict[Any], image: Image, export_func: Callable[[str, str, str],None]
+        effect_vars: dict[Any], image_source: Callable[[], tuple[Hashable, Image]], export_func: Callable[[str, str, str],None]
     ):
         super().__init__(master=parent)
         self.grid(row=0, column=0, sticky='nsew', padx=10, pady=10)
@@ -21,7 +21,7 @@ class Menu(ctk.CTkTabview):
 
         # Widgets
         PositionFrame(self.tab('Position'), pos_vars)
-        ColorFrame(self.tab('Color'), image, color_vars)
+        ColorFrame(self.tab('Color'), image_source, color_vars)
         EffectFrame(self.tab('Effect'), effect_vars)
         ExportFrame(self.tab('Export'), export_func)
 
@@ -59,18 +59,15 @@ class PositionFrame(ctk.CTkFrame):
             (pos_vars['flip'], FLIP_AXIS_OPTIONS[0]),
         )
 
-def get_image(image: str | Image) -> Image:
-    return Image.open(image) if isinstance(image, str) else image
-
 class ColorFrame(ctk.CTkFrame):
     """
     CTkFrame to apply image color filters and effects (grayscale, 4-color, inversion),
     with functionality to extract colors from the image.
     """
-    def __init__(self, parent: ctk.CTkFrame, image: Image, color_vars: dict[Any]) -> None:
+    def __init__(self, parent: ctk.CTkFrame, image_source: Callable[[], tuple[Hashable, Image]],
+                 color_vars: dict[Any]) -> None:
         super().__init__(master=parent, fg_color='transparent')
         self.pack(expand=True, fill='both')
-        self.image_file = get_image(image)
 
         SwitchPanel(
             self,
@@ -93,7 +90,7 @@ class ColorFrame(ctk.CTkFrame):
             max_value=5,
         )
 
-        ColorsPanel(self, self.image_file)
+        ColorsPanel(self, image_source)
 
         RevertButton(
             self,
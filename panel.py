@@ -1,12 +1,13 @@
 """
 Reusable panel components, used throughout the app to display editor widgets.
 """
-from typing import Callable, Optional
+from typing import Callable, Hashable, Optional
 import customtkinter as ctk
-import colorgram
 from tkinter import filedialog, messagebox, END
 from defaults import *
 from tools import hextools as HEX
+from tools.palette import cached_palette
+from tools.render_scheduler import RenderScheduler
 from PIL.Image import Image
 import menu
 
@@ -220,10 +221,11 @@ class InfoPanel(CardPanel):
 class ColorsPanel(CardPanel):
     # Card to display extracted colors from the image.
 
-    def __init__(self, parent: ctk.CTkFrame, image_file: Image):
+    def __init__(self, parent: ctk.CTkFrame, image_source: Callable[[], tuple[Hashable, Image]]):
         super().__init__(parent=parent)
-        self.image = image_file
+        self.image_source = image_source   # returns a cache key and the image to extract colors from
         self.hex_colors = []
+        self.palette_scheduler = RenderScheduler(self, on_done=self.show_palette)
         self.run_button = ctk.CTkButton(self, corner_radius=8,
                                         text='Extract colors from image',
                                         command=self.generate_palette).pack(expand=True, fill='x', padx=10)
@@ -236,11 +238,16 @@ class ColorsPanel(CardPanel):
             return px,py
 
     def generate_palette(self):
-        # Extract the top 6 most frequent colors from the open image.
+        # Extract the top 6 most frequent colors from the edited image,
+        # on a worker thread so that the app stays responsive.
 
-        colors = colorgram.extract(self.image.filename, 2**32)
-        colors = sorted(colors, key=lambda color: color.proportion)[:6]
-        self.hex_colors = [HEX.rgb_to_hex(color.rgb.r, color.rgb.g, color.rgb.b) for color in colors]
+        key, image = self.image_source()
+        self.palette_scheduler.request(lambda is_stale: cached_palette(key, image, 6))
+
+    def show_palette(self, palette: list) -> None:
+        # Display the colors extracted by generate_palette.
+
+        self.hex_colors = [HEX.rgb_to_hex(*rgb) for rgb, _ in palette]
         self.draw_colors()
 
     def draw_colors(self):
@@ -248,6 +255,8 @@ class ColorsPanel(CardPanel):
 
         self.frame.grid_forget()
         self.frame.pack(expand=True, fill='both', pady=10, padx=5)
+        for button in self.frame.winfo_children():
+            button.destroy()
 
         row, col = 0, 0
         for color in self.hex_colors:
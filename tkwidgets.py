@@ -46,4 +46,37 @@ class CloseImageViewerButton(ctk.CTkButton):
                          hover_color='firebrick2',
                          border_color='gray25',
                          width=40, height=40, command=closer)
-        self.place(relx = 0.99, rely = 0.02, anchor = 'ne')
\ No newline at end of file
+        self.place(relx = 0.99, rely = 0.02, anchor = 'ne')
+
+class BatchNavigator(ctk.CTkFrame):
+    # previous/next buttons and an index entry to browse the images of a batch
+    def __init__(self, parent, selector):
+        super().__init__(master=parent, fg_color='transparent')
+        self.selector = selector
+        self.index = 0
+        self.index_text = ctk.StringVar()
+        self.count_label = ctk.CTkLabel(self, text='/ 0')
+
+        ctk.CTkButton(self, text='<', width=40, command=lambda: self.Step(-1)).pack(side='left', padx=2)
+        index_entry = ctk.CTkEntry(self, width=60, textvariable=self.index_text, justify='center')
+        index_entry.bind('<Return>', self.Jump)
+        index_entry.pack(side='left', padx=2)
+        self.count_label.pack(side='left', padx=2)
+        ctk.CTkButton(self, text='>', width=40, command=lambda: self.Step(1)).pack(side='left', padx=2)
+        self.place(relx = 0.62, rely = 0.98, anchor = 's')
+
+    def Show(self, index, count):
+        # display the position of the open image, counted from 1
+        self.index = index
+        self.index_text.set(str(index + 1))
+        self.count_label.configure(text='/ {}'.format(count))
+
+    def Step(self, offset):
+        self.selector(self.index + offset)
+
+    def Jump(self, event):
+        # open the image whose number was typed in the entry
+        try:
+            self.selector(int(self.index_text.get()) - 1)
+        except ValueError:
+            self.index_text.set(str(self.index + 1))
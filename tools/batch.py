@@ -0,0 +1,469 @@
+"""
+Module responsible for editing and exporting batches of images in parallel.
+
+Batches are streamed: image paths are enumerated lazily and only a bounded
+number of images are being processed at any time, so memory use does not
+grow with the number of files. Exports are incremental: an
+``ExportManifest`` in the output directory records how every file was
+produced, and images whose original, recipe and encoder settings did not
+change since the last export are skipped.
+
+The module does not depend on tkinter, and can be run headless:
+
+    python -m tools.batch INPUT_DIR RECIPE.json OUTPUT_DIR [--workers N] [--force] [--prune]
+
+where the recipe is a JSON object of ``EditRecipe`` fields, e.g.
+``{"rotation": 90, "grayscale": true}``; missing fields keep their defaults.
+
+Large batches can be split across machines or processes sharing the input and
+output directories. Each shard exports the images whose file name hashes to
+it, and records them in its own manifest, so that a shard that stopped
+resumes where it was when run again. Once every shard is done, merging checks
+that each image was exported and combines the shard manifests:
+
+    python -m tools.batch INPUT_DIR RECIPE.json OUTPUT_DIR --shard 3/16
+    python -m tools.batch INPUT_DIR RECIPE.json OUTPUT_DIR --merge 16
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import cpu_count, get_context
+from typing import Iterable, Iterator, NamedTuple, Optional
+import xxhash
+from PIL import Image
+from defaults import TILED_MIN_PIXELS
+from tools import instrumentation
+from tools.image_editor import ImageEditor
+from tools.manifest import MANIFEST_NAME, ExportManifest, shard_manifest_name
+from tools.recipe import EditRecipe
+from tools.thumbnail_cache import file_hash
+from tools.tiled import render_tiled
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpeg', '.jpg')
+
+# Settings used by save_image, recorded in the export manifest.
+# Bump the version when the encoding changes in a way the settings don't show.
+ENCODER_SETTINGS = {'version': 1, 'quality': 100, 'optimize': False}
+
+
+class ExportResult(NamedTuple):
+    """
+    Outcome of exporting a single image of a batch.
+    """
+    source: str                 # path of the original image
+    output: Optional[str]       # path of the exported image, None if it failed
+    error: Optional[str]        # error message, None if everything succeeded
+    skipped: bool = False       # True if the output was already up to date
+    source_hash: Optional[str] = None   # content hash of the original
+    stage_timings: tuple = ()   # ImageEditor.stage_timings, if instrumented
+
+
+def iter_image_entries(directory: str) -> Iterator[os.DirEntry]:
+    """
+    Lazily enumerate the images of a directory. The entries cache the file
+    type and, once requested, the stat result, so no extra system call per
+    file is needed to filter them.
+
+    Args:
+        directory (str): The searched directory.
+
+    Yields:
+        os.DirEntry: Entry of each file with one of ``IMAGE_EXTENSIONS``,
+        in any letter case.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                yield entry
+
+
+def iter_image_paths(directory: str) -> Iterator[str]:
+    """
+    Lazily enumerate the paths of the images of a directory, see
+    ``iter_image_entries``.
+    """
+    for entry in iter_image_entries(directory):
+        yield entry.path
+
+
+def output_path_for(path: str, output_dir: str) -> str:
+    """
+    Get the path an image is exported to, keeping its name and extension.
+
+    Args:
+        path (str): Path of the original image.
+        output_dir (str): The export directory.
+
+    Returns:
+        str: Path of the exported image.
+    """
+    filename, extension = os.path.splitext(os.path.basename(path))
+    return "{}/{}.{}".format(output_dir, filename, extension.lstrip('.'))
+
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """
+    Parse a shard spec such as '3/16', the third of 16 shards.
+
+    Args:
+        spec (str): The shard spec, INDEX/COUNT with INDEX from 1 to COUNT.
+
+    Returns:
+        tuple[int, int]: The shard index and the number of shards.
+
+    Raises:
+        ValueError: If the spec is malformed or the index out of range.
+    """
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f'invalid shard {spec!r}, expected INDEX/COUNT, e.g. 3/16') from None
+    if not 1 <= index <= count:
+        raise ValueError(f'invalid shard {spec!r}, the index must be between 1 and {count}')
+    return index, count
+
+
+def shard_of(path: str, count: int) -> int:
+    """
+    Get the shard an image belongs to, from 1 to ``count``. Images are
+    partitioned by a hash of their file name, which does not depend on where
+    the folder is mounted nor on the listing order, so every machine computes
+    the same partition.
+    """
+    return xxhash.xxh3_64_intdigest(os.path.basename(path).encode('utf-8')) % count + 1
+
+
+def save_image(image: Image.Image, output: str) -> None:
+    """
+    Encode an edited image, with the same settings for every export.
+
+    Args:
+        image (Image.Image): The edited image.
+        output (str): Path of the exported file, its extension sets the format.
+    """
+    # Unedited JPEGs are saved with the quantization tables of the original
+    IS_JPG = image.format and image.format.lower() in ('jpeg', 'jpg')
+    quality = 'keep' if IS_JPG else ENCODER_SETTINGS['quality']
+    image.save(output, quality=quality, optimize=ENCODER_SETTINGS['optimize'])
+
+
+def render_export(image: Image.Image, recipe: EditRecipe) -> tuple[Image.Image, list[str], tuple]:
+    """
+    Edit an image for export, the same way for the headless and the GUI
+    exports, so that both write the same file.
+
+    Args:
+        image (Image.Image): The full-resolution original.
+        recipe (EditRecipe): The edit values.
+
+    Returns:
+        tuple[Image.Image, list[str], tuple]: The edited image, the stages
+        that could not be applied, and the stage timings of the render.
+    """
+    # Very large images are edited tile by tile to bound memory use.
+    # Unedited ones are saved from the source, as JPEGs keep its
+    # quantization tables.
+    if image.size[0] * image.size[1] >= TILED_MIN_PIXELS and recipe != EditRecipe():
+        edited, failed_stages = render_tiled(image, recipe)
+        return edited, failed_stages, ()
+
+    # Intermediate results are not kept, so stages can reuse them
+    editor = ImageEditor(image, in_place=True)
+    editor.apply(recipe)
+    return editor.get_image_output, editor.failed_stages, tuple(editor.stage_timings)
+
+
+def export_image(path: str, output_dir: str, recipe: EditRecipe) -> ExportResult:
+    """
+    Decode, edit and encode a single image.
+
+    Args:
+        path (str): Path of the original image.
+        output_dir (str): The export directory.
+        recipe (EditRecipe): The edits applied to the images.
+
+    Returns:
+        ExportResult: The exported file, or the reason the export failed.
+    """
+    try:
+        with Image.open(path) as image:
+            edited, failed_stages, stage_timings = render_export(image, recipe)
+            output = output_path_for(path, output_dir)
+            save_image(edited, output)
+        source_hash = file_hash(path)
+    except Exception as exc:
+        return ExportResult(path, None, '{}: {}'.format(type(exc).__name__, exc))
+
+    error = None
+    if failed_stages:
+        error = 'Cannot apply inversion to image filetype.'
+    return ExportResult(path, output, error, source_hash=source_hash,
+                        stage_timings=stage_timings)
+
+
+def iter_export_images(paths: Iterable[str], output_dir: str, recipe: EditRecipe,
+                       workers: Optional[int] = None,
+                       max_in_flight: Optional[int] = None,
+                       incremental: bool = True,
+                       prune: bool = False,
+                       shard: Optional[tuple[int, int]] = None) -> Iterator[ExportResult]:
+    """
+    Export a stream of images, each one decoded, edited, encoded and released
+    by one of a pool of worker processes, and record the exports in the
+    output directory's ``ExportManifest``.
+
+    Args:
+        paths (Iterable[str]): Paths of the original images, consumed lazily.
+        output_dir (str): The export directory.
+        recipe (EditRecipe): The edits applied to the images.
+        workers (int, optional): Number of worker processes, 1 exports in the
+        calling process. Defaults to ``cpu_count()``.
+        max_in_flight (int, optional): Maximum number of images submitted to the
+        pool and not yet finished. Defaults to twice the number of workers.
+        incremental (bool, optional): Skip the images whose output is up to
+        date according to the manifest. Defaults to True.
+        prune (bool, optional): Once every image is exported, delete the
+        outputs recorded in the manifest whose original is not in ``paths``
+        anymore. Defaults to False.
+        shard (tuple[int, int], optional): Only export the images of this
+        (index, count) shard, see ``shard_of``, and record them in the
+        manifest of the shard. Defaults to None, exporting every image.
+
+    Yields:
+        ExportResult: One result per image, in completion order.
+    """
+    manifest = ExportManifest(output_dir, shard_manifest_name(*shard) if shard else MANIFEST_NAME)
+    manifest.complete = False
+    recipe_hash = recipe.content_hash()
+    outputs = set()
+
+    def paths_to_export():
+        for path in paths:
+            if shard is not None and shard_of(path, shard[1]) != shard[0]:
+                continue
+            output = output_path_for(path, output_dir)
+            outputs.add(output)
+            if incremental and manifest.is_up_to_date(path, output, recipe_hash, ENCODER_SETTINGS):
+                yield ExportResult(path, output, None, skipped=True)
+            else:
+                yield path
+
+    try:
+        for result in _export_stream(paths_to_export(), output_dir, recipe, workers, max_in_flight):
+            # Exports with errors are not recorded, so that they are retried
+            # and reported again by the next run
+            if result.output is not None and not result.skipped and result.error is None:
+                manifest.record(result.source, result.output, recipe_hash,
+                                ENCODER_SETTINGS, result.source_hash)
+            yield result
+
+        if prune:
+            manifest.prune(outputs)
+        manifest.complete = True
+    finally:
+        manifest.save()
+
+
+def _export_stream(items: Iterable, output_dir: str, recipe: EditRecipe,
+                   workers: Optional[int], max_in_flight: Optional[int]) -> Iterator[ExportResult]:
+    # Run export_image over the paths, with a bounded number of images in
+    # flight. Items that are already an ExportResult (skipped images) are
+    # passed through as soon as they come.
+    workers = workers or cpu_count()
+    if workers == 1:
+        for item in items:
+            yield item if isinstance(item, ExportResult) else export_image(item, output_dir, recipe)
+        return
+
+    def collect(future):
+        # Add the stage timings of the worker to the profile of this process
+        result = future.result()
+        for stage, *call in result.stage_timings:
+            instrumentation.profile.add(stage, [call])
+        return result
+
+    max_in_flight = max_in_flight or 2 * workers
+    # Workers are spawned rather than forked: the GUI process runs threads
+    # (renders, prefetches) that may hold a lock at the time of a fork, which
+    # the child would then wait for forever
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=get_context('spawn'),
+        initializer=_init_worker, initargs=(instrumentation.enabled,),
+    )
+    with executor:
+        in_flight = set()
+        for item in items:
+            if isinstance(item, ExportResult):
+                yield item
+                continue
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield collect(future)
+            in_flight.add(executor.submit(export_image, item, output_dir, recipe))
+
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield collect(future)
+
+
+def _init_worker(profiling: bool) -> None:
+    # Spawned workers do not inherit instrumentation enabled from Python
+    if profiling:
+        instrumentation.enable()
+
+
+def export_images(paths: Iterable[str], output_dir: str, recipe: EditRecipe,
+                  **kwargs) -> list[ExportResult]:
+    """
+    Export a batch of images, see ``iter_export_images`` for the arguments.
+
+    Returns:
+        list[ExportResult]: One result per image, in completion order.
+    """
+    return list(iter_export_images(paths, output_dir, recipe, **kwargs))
+
+
+def merge_shards(paths: Iterable[str], output_dir: str, recipe: EditRecipe,
+                 count: int) -> tuple[list[int], list[str]]:
+    """
+    Merge the manifests of the shards of an export into the manifest of the
+    output directory, and check that the shards exported every image. The
+    shards may have read the originals from other mounts of the folder, so
+    their entries are matched by output name and original contents.
+
+    Args:
+        paths (Iterable[str]): Paths of the original images of the export.
+        output_dir (str): The export directory.
+        recipe (EditRecipe): The edits applied to the images.
+        count (int): Number of shards of the export.
+
+    Returns:
+        tuple[list[int], list[str]]: Indexes of the shards that did not
+        finish, and paths of the images whose output is missing or not up to
+        date. The export is complete if both are empty.
+    """
+    shards = {index: ExportManifest(output_dir, shard_manifest_name(index, count))
+              for index in range(1, count + 1)}
+    recipe_hash = recipe.content_hash()
+    missing = [
+        path for path in paths
+        if not shards[shard_of(path, count)].is_up_to_date(
+            path, output_path_for(path, output_dir), recipe_hash, ENCODER_SETTINGS,
+            match_path=False,
+        )
+    ]
+
+    manifest = ExportManifest(output_dir)
+    for shard in shards.values():
+        manifest.merge(shard)
+    manifest.complete = not missing
+    manifest.save()
+    return [index for index, shard in shards.items() if not shard.complete], missing
+
+
+def load_recipe(recipe_path: str) -> EditRecipe:
+    """
+    Read an edit recipe from a JSON file.
+
+    Args:
+        recipe_path (str): Path of the JSON recipe.
+
+    Returns:
+        EditRecipe: The recipe, missing values keep their defaults.
+    """
+    with open(recipe_path) as recipe_file:
+        return EditRecipe.from_json(recipe_file.read())
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Headless entry point, exporting every image of a directory with a recipe.
+
+    Returns:
+        int: Process exit code, 1 if any image failed to export.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m tools.batch',
+        description='Edit and export every image of a directory.',
+    )
+    parser.add_argument('input_dir', help='directory of the original images')
+    parser.add_argument('recipe', help='JSON file with the edit recipe')
+    parser.add_argument('output_dir', help='directory the images are exported to')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default: CPU count)')
+    parser.add_argument('--force', action='store_true',
+                        help='export every image, even if its output is up to date')
+    parser.add_argument('--prune', action='store_true',
+                        help='delete previous exports of originals that were removed')
+    parser.add_argument('--quiet', action='store_true', help='do not report progress')
+    sharding = parser.add_mutually_exclusive_group()
+    sharding.add_argument('--shard', metavar='INDEX/COUNT',
+                          help='only export the images of this shard, e.g. 3/16')
+    sharding.add_argument('--merge', metavar='COUNT', type=int,
+                          help='check and merge the manifests of COUNT finished shards')
+    args = parser.parse_args(argv)
+
+    shard = None
+    if args.shard is not None:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as exc:
+            parser.error(str(exc))
+    if args.merge is not None:
+        if args.merge < 1:
+            parser.error('the number of shards must be at least 1')
+        # Merging only checks the shards, it neither exports nor deletes
+        for option in ('force', 'prune'):
+            if getattr(args, option):
+                parser.error('argument --{}: not allowed with argument --merge'.format(option))
+
+    try:
+        recipe = load_recipe(args.recipe)
+    except (OSError, TypeError, ValueError) as exc:
+        parser.error('invalid recipe {}: {}'.format(args.recipe, exc))
+    try:
+        # Images are listed lazily, only check that the directory can be read
+        with os.scandir(args.input_dir):
+            pass
+    except OSError as exc:
+        parser.error('cannot read the input directory: {}'.format(exc))
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.merge is not None:
+        paths = iter_image_paths(args.input_dir)
+        incomplete, missing = merge_shards(paths, args.output_dir, recipe, args.merge)
+        for index in incomplete:
+            print('shard {}/{} did not finish'.format(index, args.merge), file=sys.stderr)
+        for path in missing:
+            print('{}: not exported'.format(path), file=sys.stderr)
+        if not args.quiet:
+            print('{} shards merged, {} images missing'.format(args.merge, len(missing)),
+                  file=sys.stderr)
+        return 1 if incomplete or missing else 0
+
+    exported, skipped, failed = 0, 0, 0
+    paths = iter_image_paths(args.input_dir)
+    results = iter_export_images(paths, args.output_dir, recipe, args.workers,
+                                 incremental=not args.force, prune=args.prune, shard=shard)
+    for result in results:
+        skipped += result.skipped
+        exported += result.output is not None and not result.skipped
+        if result.error:
+            failed += 1
+            print('{}: {}'.format(result.source, result.error), file=sys.stderr)
+        if not args.quiet:
+            print('\rexported {} images, {} up to date, {} errors'.format(exported, skipped, failed),
+                  end='', file=sys.stderr, flush=True)
+
+    if not args.quiet:
+        print(file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
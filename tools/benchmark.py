@@ -0,0 +1,328 @@
+"""
+Benchmark suite for the ``ImageEditor`` operations and batch export.
+
+Times every editing operation, the full edit chain and the batch export
+throughput on synthesized images of several sizes and modes, and on the
+sample images, then reports the results as JSON:
+
+    python -m tools.benchmark [--megapixels 1 12 48] [--output results.json]
+    python -m tools.benchmark --compare baseline.json
+
+Result keys only depend on the benchmark parameters, so the reports of two
+runs can be compared key by key (``--compare`` prints the speed ratios).
+"""
+
+import argparse
+import ctypes
+import glob
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Optional
+import numpy as np
+import PIL
+from PIL import Image
+from tools.batch import export_images
+from tools.image_editor import ImageEditor
+from tools.recipe import EditRecipe
+
+MODES = ('RGB', 'RGBA', 'L', 'P')
+
+# (operation name, ImageEditor method, arguments), with non-default values
+OPERATIONS = (
+    ('rotation',          'rotation',          (30,)),
+    ('zoom',              'zoom',              (100,)),
+    ('flip',              'flip',              ('Both',)),
+    ('geometry',          'geometry',          (30, 100, 'Both')),
+    ('brightness',        'brightness',        (1.5,)),
+    ('saturation',        'saturation',        (0.5,)),
+    ('grayscale',         'grayscale',         (True,)),
+    ('color_invert',      'color_invert',      (True,)),
+    ('color',             'color',             (0.8, 0.5, False, True)),
+    ('four_color_filter', 'four_color_filter', (True,)),
+    ('blur',              'blur',              (10,)),
+    ('contrast',          'contrast',          (5,)),
+    ('hue',               'hue',               (40,)),
+)
+
+# Every edit enabled, for the full chain and batch export
+FULL_RECIPE = EditRecipe(
+    rotation=30, zoom=100, flip='Both', brightness=1.2, saturation=0.8,
+    invert=True, blur=4, contrast=3, hue=40,
+)
+
+
+def synthesize_image(megapixels: float, mode: str, seed: int = 0) -> Image.Image:
+    """
+    Create a deterministic test image: smooth color gradients with noise, so
+    that filters, quantization and encoding see realistic content.
+
+    Args:
+        megapixels (float): Image size, with a 3:2 aspect ratio.
+        mode (str): One of ``MODES``.
+        seed (int, optional): Seed of the noise. Defaults to 0.
+
+    Returns:
+        Image.Image: The synthesized image.
+    """
+    width = int(round((megapixels * 1e6 * 3 / 2) ** 0.5))
+    height = int(round(megapixels * 1e6 / width))
+
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    for band, gradient in enumerate((x + 0 * y, y + 0 * x, (x + y) / 2, 255 - x / 2 + 0 * y)):
+        noise = rng.integers(-16, 16, size=(height, width), dtype=np.int16)
+        pixels[..., band] = np.clip(gradient + noise, 0, 255)
+
+    image = Image.fromarray(pixels)
+    if mode == 'P':
+        return image.convert('RGB').convert('P', palette=Image.Palette.ADAPTIVE)
+    return image.convert(mode)
+
+
+def peak_rss_mb() -> float:
+    """
+    Get the peak resident memory of the process so far, in MiB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, in KiB elsewhere
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak resident memory of the process to its current value, so
+    that the memory used by a single call can be measured. Only supported on
+    Linux.
+
+    Returns:
+        bool: False if the peak could not be reset.
+    """
+    try:
+        # Give the memory freed by previous calls back to the system first,
+        # otherwise allocations reusing it do not show in the resident memory
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def status_mb(field: str) -> float:
+    """
+    Read a memory field of ``/proc/self/status``, e.g. 'VmRSS' for the current
+    resident memory or 'VmHWM' for its peak, in MiB.
+    """
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    raise KeyError(field)
+
+
+def time_call(func: Callable[..., Any], repeat: int,
+              setup: Optional[Callable[[], Any]] = None) -> dict[str, Any]:
+    """
+    Time a function over several runs.
+
+    Args:
+        func (Callable[..., Any]): The timed function, called with the
+        result of ``setup`` if given, without arguments otherwise.
+        repeat (int): Number of runs.
+        setup (Callable[[], Any], optional): Called before each run, outside
+        of the timed and measured region. Defaults to None.
+
+    Returns:
+        dict[str, Any]: Best and median wall time in seconds, and on Linux the
+        largest resident memory a run added to the process, in MiB. ``error``
+        holds the exception if the function failed.
+    """
+    times, extra_rss = [], []
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        measure_rss = reset_peak_rss()
+        if measure_rss:
+            rss_before = status_mb('VmRSS')
+        start = time.perf_counter()
+        try:
+            func(argument) if setup is not None else func()
+        except Exception as exc:
+            return {'error': '{}: {}'.format(type(exc).__name__, exc)}
+        times.append(time.perf_counter() - start)
+        if measure_rss:
+            extra_rss.append(status_mb('VmHWM') - rss_before)
+
+    timing = {'best_s': min(times), 'median_s': statistics.median(times)}
+    if extra_rss:
+        timing['extra_rss_mb'] = round(max(extra_rss), 1)
+    return timing
+
+
+def with_rates(timing: dict[str, Any], megapixels: float, count: int = 1) -> dict[str, Any]:
+    # Add throughput figures computed from the best time.
+    if 'best_s' in timing:
+        timing['ops_per_s'] = count / timing['best_s']
+        timing['mp_per_s'] = count * megapixels / timing['best_s']
+    return timing
+
+
+def bench_image(image: Image.Image, repeat: int) -> dict[str, Any]:
+    """
+    Time every operation and the full edit chain on one image.
+    """
+    megapixels = image.size[0] * image.size[1] / 1e6
+    results = {}
+    # Editors are created outside of the timed region, as they convert
+    # palette images to RGB
+    for name, method, args in OPERATIONS:
+        def run(editor):
+            getattr(editor, method)(*args)
+        results[name] = with_rates(
+            time_call(run, repeat, setup=lambda: ImageEditor(image)), megapixels
+        )
+
+    def run_chain(editor):
+        editor.apply(FULL_RECIPE)
+    results['full_chain'] = with_rates(
+        time_call(run_chain, repeat, setup=lambda: ImageEditor(image)), megapixels
+    )
+    results['full_chain_in_place'] = with_rates(
+        time_call(run_chain, repeat, setup=lambda: ImageEditor(image, in_place=True)), megapixels
+    )
+    return results
+
+
+def bench_batch(count: int, megapixels: float, workers: Optional[int],
+                repeat: int) -> dict[str, Any]:
+    """
+    Time the batch export of synthesized JPEG files. With several workers, the
+    memory used by the worker processes is not measured.
+    """
+    with tempfile.TemporaryDirectory() as input_dir, tempfile.TemporaryDirectory() as output_dir:
+        paths = []
+        for index in range(count):
+            path = os.path.join(input_dir, '{}.jpg'.format(index))
+            synthesize_image(megapixels, 'RGB', seed=index).save(path, quality=90)
+            paths.append(path)
+
+        def run():
+            results = export_images(paths, output_dir, FULL_RECIPE,
+                                    workers=workers, incremental=False)
+            errors = [result.error for result in results if result.error]
+            if errors:
+                raise RuntimeError(errors[0])
+
+        timing = with_rates(time_call(run, repeat), megapixels, count)
+    timing.update({'images': count, 'megapixels': megapixels, 'workers': workers or os.cpu_count()})
+    return timing
+
+
+def run(megapixels: list[float], modes: list[str], samples: Optional[str], repeat: int,
+        batch_images: int, batch_megapixels: float, workers: Optional[int]) -> dict[str, Any]:
+    """
+    Run the whole benchmark suite.
+
+    Returns:
+        dict[str, Any]: The report, see the module docstring.
+    """
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'parameters': {'repeat': repeat},
+        'images': {},
+    }
+
+    for size in megapixels:
+        for mode in modes:
+            image = synthesize_image(size, mode)
+            image.load()
+            report['images']['synthetic-{}mp-{}'.format(size, mode)] = bench_image(image, repeat)
+            del image
+
+    if samples:
+        for path in sorted(glob.glob(os.path.join(samples, '*'))):
+            with Image.open(path) as image:
+                image.load()
+                report['images'][os.path.basename(path)] = bench_image(image, repeat)
+
+    if batch_images:
+        report['batch'] = bench_batch(batch_images, batch_megapixels, workers, repeat)
+    report['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    return report
+
+
+def compare(report: dict[str, Any], baseline: dict[str, Any]) -> list[str]:
+    """
+    Compare the best times of two reports.
+
+    Returns:
+        list[str]: One line per measurement present in both reports, with the
+        speedup of ``report`` over ``baseline`` (below 1 is a regression).
+    """
+    lines = []
+    for image_name, operations in report['images'].items():
+        for operation, timing in operations.items():
+            previous = baseline.get('images', {}).get(image_name, {}).get(operation, {})
+            if 'best_s' in timing and 'best_s' in previous:
+                lines.append('{:<45} {:<18} {:6.2f}x'.format(
+                    image_name, operation, previous['best_s'] / timing['best_s']))
+    if 'best_s' in report.get('batch', {}) and 'best_s' in baseline.get('batch', {}):
+        lines.append('{:<45} {:<18} {:6.2f}x'.format(
+            'batch', 'export', baseline['batch']['best_s'] / report['batch']['best_s']))
+    return lines
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m tools.benchmark',
+        description='Benchmark the image editing operations and batch export.',
+    )
+    parser.add_argument('--megapixels', type=float, nargs='*', default=[1, 12, 48],
+                        help='sizes of the synthesized images (default: 1 12 48)')
+    parser.add_argument('--modes', nargs='*', default=list(MODES), choices=MODES,
+                        help='modes of the synthesized images (default: all)')
+    parser.add_argument('--samples', default='imgs',
+                        help='directory of sample images, empty to skip (default: imgs)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement')
+    parser.add_argument('--batch-images', type=int, default=16,
+                        help='number of images in the batch export benchmark, 0 to skip')
+    parser.add_argument('--batch-megapixels', type=float, default=12,
+                        help='size of the batch export images')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='batch export worker processes (default: CPU count)')
+    parser.add_argument('--output', help='write the JSON report to this file')
+    parser.add_argument('--compare', help='JSON report of a previous run to compare with')
+    args = parser.parse_args(argv)
+
+    report = run(args.megapixels, args.modes, args.samples or None, args.repeat,
+                 args.batch_images, args.batch_megapixels, args.workers)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        print('\n'.join(compare(report, baseline)), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
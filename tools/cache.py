@@ -0,0 +1,96 @@
+"""
+Module providing in-memory caches for decoded and edited images.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from PIL import Image
+
+
+def image_nbytes(image: Image.Image) -> int:
+    """
+    Estimate the memory used by the pixels of an image.
+
+    Args:
+        image (Image.Image): The measured image.
+
+    Returns:
+        int: Approximate size of the pixel data, in bytes.
+    """
+    band_size = 4 if image.mode in ('I', 'F') else 1
+    return image.size[0] * image.size[1] * len(image.getbands()) * band_size
+
+
+class ImageLRU:
+    """
+    Thread-safe least-recently-used cache bounded by a number of entries and
+    by the total size of the cached images.
+    """
+    def __init__(self, max_bytes: int, max_items: int = 64) -> None:
+        """
+        Args:
+            max_bytes (int): Budget for the summed size of the cached images.
+            max_items (int, optional): Maximum number of entries. Defaults to 64.
+        """
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.nbytes = 0
+        self._entries = OrderedDict()    # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a cached value and mark it as recently used.
+
+        Args:
+            key (Hashable): The entry key.
+
+        Returns:
+            Any: The cached value, or None if the key is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> None:
+        """
+        Cache a value, evicting the least recently used entries to stay
+        within budget. Values larger than the whole budget are not cached.
+
+        Args:
+            key (Hashable): The entry key.
+            value (Any): The cached value.
+            size (int): Size of the value in bytes, see ``image_nbytes``.
+        """
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes or len(self._entries) > self.max_items:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_size
+
+    def clear(self) -> None:
+        """
+        Remove every entry from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
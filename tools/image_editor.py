@@ -2,16 +2,67 @@
 Module responsible for providing image manipulation functionalities.
 """
 
+import math
+import time
 from defaults import *
 from PIL import Image, ImageOps, ImageEnhance, ImageFilter
-import numpy as np
+from typing import Callable, Hashable, Optional
+from tools import instrumentation
+from tools.blur import blur_engine, blur_image
+from tools.cache import ImageLRU, image_nbytes
+from tools.planner import geometry_size, plan_stages
+from tools.recipe import EditRecipe
+from tools.strips import edit_in_strips, filter_in_strips, halo_for_radius
+from tools.point_ops import SUPPORTED_MODES, apply_color_ops, shift_hue
+from tools.quantize import compute_palette, map_to_palette
+
+class RenderCancelled(Exception):
+    """
+    Raised when a render is abandoned because its result is no longer needed.
+    """
+
 
 class ImageEditor:
     """
     Class containing all image-manipulation methods used in the app.
     """
-    def __init__(self, image_file: Image.Image) -> None:
+    def __init__(self, image_file: Image.Image, scale: float = 1.0,
+                 cache: Optional[ImageLRU] = None, in_place: bool = False,
+                 source_key: Optional[Hashable] = None) -> None:
+        """
+        Args:
+            image_file (Image.Image): The image to edit.
+            scale (float, optional): Size of ``image_file`` relative to the
+            full-resolution original, used to scale pixel-based parameters
+            (zoom, blur and contrast radii) when editing a preview proxy.
+            Defaults to 1.0.
+            cache (ImageLRU, optional): Cache of intermediate stage results,
+            shared between editors so that ``apply`` can resume from the last
+            stage whose inputs did not change. Defaults to None.
+            in_place (bool, optional): Run the stages strip by strip (see
+            ``tools.strips``): the per-pixel stages overwrite the intermediate
+            images of the render instead of allocating new ones, so that a
+            whole chain holds about two full-size images at once. The source
+            image is never modified. Ignored when a ``cache`` is given, as its
+            entries must not change. Defaults to False.
+            source_key (Hashable, optional): Identifies the source in the
+            ``cache`` keys, with its size and ``scale``, e.g. the path of the
+            image file, so that a new proxy of the same file reuses the
+            stages rendered from a previous one. Defaults to None, the
+            identity of ``image_file``.
+        """
+        self.source_image = image_file
         self.used_image = image_file
+        self.scale = scale
+        self.cache = cache
+        self.source_key = source_key
+        self.in_place = in_place and cache is None
+        self.failed_stages = []
+        # Stages chosen by the planner for the last apply
+        self.plan = None
+        # (stage, seconds, output pixels, allocated bytes) of each stage run
+        # by apply, only filled while instrumentation is enabled
+        self.stage_timings = []
         if self.used_image.mode == 'P':
             self.used_image = self.used_image.convert('RGB')
 
@@ -34,7 +85,7 @@ class ImageEditor:
             zoom_amount (float): The given zoom amount.
         """
         if zoom_amount != ZOOM_DEFAULT:
-            self.used_image = ImageOps.crop(self.used_image, border=zoom_amount)
+            self.used_image = ImageOps.crop(self.used_image, border=zoom_amount * self.scale)
 
     def flip(self, flip_option: str) -> None:
         """
@@ -44,7 +95,10 @@ class ImageEditor:
             flip_option (str): The flip type, can be 'X' for horizontal,
             'Y' for vertical, and 'Both' for both directions.
         """
-        if flip_option != 'None':
+        if flip_option == 'Both':
+            # Mirroring and flipping is a half turn, done in a single pass
+            self.used_image = self.used_image.transpose(Image.Transpose.ROTATE_180)
+        elif flip_option != 'None':
             mirror = flip_option in ('X', 'Both')
             flip = flip_option in ('Y', 'Both')
             if mirror:
@@ -52,6 +106,36 @@ class ImageEditor:
             if flip:
                 self.used_image = ImageOps.flip(self.used_image)
 
+    def geometry(self, rotation_angle: float, zoom_amount: float, flip_option: str) -> None:
+        """
+        Apply the rotation, zoom and flip edits at once, as a single affine
+        transform that only samples the source pixels landing in the output.
+        Gives the same result as calling the three methods in that order, up to
+        the nearest-neighbour rounding of rotated pixels.
+
+        Args:
+            rotation_angle (float): rotation angle.
+            zoom_amount (float): The given zoom amount.
+            flip_option (str): The flip type, see ``flip``.
+        """
+        unchanged = (
+            rotation_angle == ROTATION_DEFAULT and
+            zoom_amount == ZOOM_DEFAULT and
+            flip_option == FLIP_AXIS_OPTIONS[0]
+        )
+        if unchanged:
+            return
+        # Without rotation, cropping and transposing is cheaper than resampling
+        if rotation_angle % 360.0 == 0:
+            self.zoom(zoom_amount)
+            self.flip(flip_option)
+            return
+
+        size, matrix = geometry_transform(
+            self.used_image.size, rotation_angle, zoom_amount, flip_option, self.scale
+        )
+        self.used_image = self.used_image.transform(size, Image.AFFINE, matrix, Image.NEAREST)
+
     def brightness(self, brightness_value: float) -> None:
         """
         Change the image brightness by a given amount.
@@ -99,27 +183,82 @@ class ImageEditor:
             except:
                 raise OSError
 
-    def four_color_filter(self, four_col_flag: bool) -> None:
+    def color(self, brightness_value: float, saturation_value: float,
+              grayscale_flag: bool, invert_flag: bool) -> None:
+        """
+        Apply the brightness, saturation, grayscale and color inversion edits
+        at once, with the fused kernel from ``tools.point_ops``. Gives the same
+        result as calling the four methods in that order.
+
+        Args:
+            brightness_value (float): New brightness value.
+            saturation_value (float): New saturation value.
+            grayscale_flag (bool): Set to True, if the grayscale filter is chosen.
+            invert_flag (bool): Set to True, if the negative filter is chosen.
+        """
+        if self.used_image.mode not in SUPPORTED_MODES:
+            self.brightness(brightness_value)
+            self.saturation(saturation_value)
+            self.grayscale(grayscale_flag)
+            self.color_invert(invert_flag)
+            return
+
+        unchanged = (
+            brightness_value == BRIGHTNESS_DEFAULT and
+            saturation_value == SATURATION_DEFAULT and
+            not grayscale_flag and not invert_flag
+        )
+        if unchanged:
+            return
+
+        try:
+            self._edit_pixels(lambda image: apply_color_ops(
+                image, brightness_value, saturation_value, grayscale_flag, invert_flag,
+            ))
+        except OSError:
+            # Keep the other edits when the image cannot be inverted
+            self.used_image = apply_color_ops(
+                self.used_image, brightness_value, saturation_value,
+                grayscale_flag, False,
+            )
+            raise
+
+    def four_color_filter(self, four_col_flag: bool, method: str = QUANTIZE_METHOD,
+                          dither: bool = QUANTIZE_DITHER) -> None:
         """
         Apply a 4-color filter to the image i.e. display the image using only 4 colors,
-        extracted from the image by an algorithm implemented in Pillow.
+        extracted from the image by the quantizer of ``tools.quantize``.
 
         Args:
             four_col_flag (bool): Set to True, if the filter is chosen.
+            method (str, optional): Palette algorithm, see ``quantize.QUANTIZE_METHODS``.
+            Defaults to ``QUANTIZE_METHOD``.
+            dither (bool, optional): Dither the result. Defaults to ``QUANTIZE_DITHER``.
         """
         if four_col_flag:
-            self.used_image = self.used_image.convert("P", palette=Image.ADAPTIVE, colors=4)
+            palette = compute_palette(self.used_image, 4, method)
+            if dither:
+                # The dithering error is diffused from row to row
+                self.used_image = map_to_palette(self.used_image, palette, dither)
+            else:
+                self._edit_pixels(lambda image: map_to_palette(image, palette))
 
-    def blur(self, blur_value: float) -> None:
+    def blur(self, blur_value: float, method: str = BLUR_METHOD) -> None:
         """
         Blur the image by a given amount.
 
         Args:
             blur_value (float): Blur intensity.
+            method (str, optional): Blur engine, see ``blur.blur_image``.
+            Defaults to ``BLUR_METHOD``.
         """
         if blur_value != BLUR_DEFAULT:
-            blur_filter = ImageFilter.GaussianBlur(blur_value)
-            self.used_image = self.used_image.filter(blur_filter)
+            radius = blur_value * self.scale
+            # The 'downsample' engine is approximate, its strips would not match
+            if blur_engine(self.used_image, radius, method) == 'gaussian':
+                self._filter_pixels(lambda image: blur_image(image, radius, 'gaussian'), radius)
+            else:
+                self.used_image = blur_image(self.used_image, radius, method)
 
     def contrast(self, contrast_value: float) -> None:
         """
@@ -129,28 +268,111 @@ class ImageEditor:
             contrast_value (float): Used contrast value.
         """
         if contrast_value != CONTRAST_DEFAULT:
-            contrast_filter = ImageFilter.UnsharpMask(contrast_value)
-            self.used_image = self.used_image.filter(contrast_filter)
+            contrast_filter = ImageFilter.UnsharpMask(contrast_value * self.scale)
+            self._filter_pixels(
+                lambda image: image.filter(contrast_filter), contrast_value * self.scale
+            )
 
-    def hue(self, hue_value: int) -> None:
+    def hue(self, hue_value: int, method: str = HUE_METHOD) -> None:
         """
         Change the image hue (color) by a given amount.
 
         Args:
             hue_value (int): Ranges from -100 to 100.
+            method (str, optional): Hue engine, see ``point_ops.shift_hue``.
+            Defaults to ``HUE_METHOD``.
         """
         if hue_value != HUE_DEFAULT:
-            used_operation = np.add if hue_value > 0 else np.subtract
-            hue_value = abs(hue_value)
-            hsv_im = self.used_image.convert("HSV")
-            h_chan, s_chan, v_chan = hsv_im.split()
+            self._edit_pixels(lambda image: shift_hue(image, int(hue_value), method))
+
+    def _edit_pixels(self, edit: Callable[[Image.Image], Image.Image]) -> None:
+        # Apply a per-pixel edit, in place for intermediate images of in-place
+        # renders. The source image belongs to the caller and is never changed.
+        if self.in_place and self.used_image is not self.source_image:
+            self.used_image = edit_in_strips(self.used_image, edit)
+        else:
+            self.used_image = edit(self.used_image)
+
+    def _filter_pixels(self, edit: Callable[[Image.Image], Image.Image], radius: float) -> None:
+        # Apply a gaussian-based filter, by strips for in-place renders so
+        # that the filter temporaries stay the size of a strip
+        if self.in_place:
+            self.used_image = filter_in_strips(self.used_image, edit, halo_for_radius(radius))
+        else:
+            self.used_image = edit(self.used_image)
+
+    def apply(self, recipe: EditRecipe,
+              is_cancelled: Optional[Callable[[], bool]] = None) -> None:
+        """
+        Apply every edit of the recipe, with the stages planned by
+        ``planner.plan_stages``, giving the same result as ``EDIT_STAGES``
+        order. Stages that cannot be applied to the image (e.g. inverting an
+        RGBA image) are skipped and recorded in ``failed_stages``.
+
+        Args:
+            recipe (EditRecipe): The edit values.
+            is_cancelled (Callable[[], bool], optional): Checked before each stage,
+            the render stops with ``RenderCancelled`` once it returns True.
+        """
+        self.plan = plan_stages(recipe, self.used_image.size, self.used_image.mode, self.scale)
+        stages = self.plan.stages
 
-            h_chan_np = np.array(h_chan)
-            h_chan_np = used_operation(h_chan_np, hue_value)
-            h_chan = Image.fromarray(h_chan_np)
+        # Cache keys hold the stages and values up to and including the
+        # cached one, so a hit means the whole prefix of the pipeline matches
+        prefix_keys = []
+        if self.source_key is not None:
+            prefix = (self.source_key, self.source_image.size, self.scale)
+        else:
+            prefix = (id(self.source_image), self.scale)
+        for method, field_names in stages:
+            prefix += (method, *(getattr(recipe, name) for name in field_names))
+            prefix_keys.append(prefix)
+
+        first_stage = 0
+        if self.cache is not None:
+            for index in reversed(range(len(stages))):
+                cached = self.cache.get(prefix_keys[index])
+                # The source is kept in the entry so that its id cannot be reused
+                if cached is not None and (self.source_key is not None or cached[0] is self.source_image):
+                    _, self.used_image, failed_stages = cached
+                    self.failed_stages = list(failed_stages)
+                    first_stage = index + 1
+                    break
+
+        profiling = instrumentation.enabled
+        for index in range(first_stage, len(stages)):
+            if is_cancelled is not None and is_cancelled():
+                raise RenderCancelled
+
+            method, field_names = stages[index]
+            stage_input = self.used_image
+            if profiling:
+                start = time.perf_counter()
+            try:
+                getattr(self, method)(*(getattr(recipe, name) for name in field_names))
+            except OSError:
+                self.failed_stages.append(method)
+            if profiling:
+                self._record_stage(method, time.perf_counter() - start, stage_input)
 
-            result = Image.merge("HSV", (h_chan, s_chan, v_chan))
-            self.used_image = result.convert("RGB")
+            # Stages left at their default value return their input unchanged
+            if self.cache is not None and self.used_image is not stage_input:
+                self.cache.put(
+                    prefix_keys[index],
+                    (self.source_image, self.used_image, tuple(self.failed_stages)),
+                    image_nbytes(self.used_image),
+                )
+
+    def _record_stage(self, method: str, seconds: float, stage_input: Image.Image) -> None:
+        # Only stages returning a new image allocated memory
+        output = self.used_image
+        call = (
+            seconds,
+            output.size[0] * output.size[1],
+            image_nbytes(output) if output is not stage_input else 0,
+        )
+        self.stage_timings.append((method, *call))
+        instrumentation.profile.add(method, [call])
 
     @property
     def get_image_output(self) -> Image.Image:
@@ -160,4 +382,127 @@ class ImageEditor:
         Returns:
             Image.Image: The resulting image.
         """
-        return self.used_image
\ No newline at end of file
+        return self.used_image
+
+
+def geometry_transform(size: tuple[int, int], rotation: float, zoom: float,
+                       flip: str, scale: float = 1.0) -> tuple[tuple[int, int], list[float]]:
+    """
+    Compose the rotation, zoom and flip edits of ``ImageEditor`` into one
+    affine transform.
+
+    Args:
+        size (tuple[int, int]): Size of the source image.
+        rotation (float): Rotation angle, see ``ImageEditor.rotation``.
+        zoom (float): Zoom amount, see ``ImageEditor.zoom``.
+        flip (str): Flip option, see ``ImageEditor.flip``.
+        scale (float, optional): Scale of the source relative to the original.
+        Defaults to 1.0.
+
+    Returns:
+        tuple[tuple[int, int], list[float]]: Size of the edited image, and the
+        ``Image.transform`` AFFINE coefficients mapping its pixels to the source.
+    """
+    width, height = size
+
+    # Rotation about the center without expanding, as Image.rotate
+    angle = -math.radians(rotation % 360.0)
+    a, b = round(math.cos(angle), 15), round(math.sin(angle), 15)
+    d, e = -b, a
+    c = a * -width / 2.0 + b * -height / 2.0 + width / 2.0
+    f = d * -width / 2.0 + e * -height / 2.0 + height / 2.0
+
+    # Zoom crops the same border on every side, rounded as Image.crop
+    border = zoom * scale
+    left, top = round(border), round(border)
+    output_size = geometry_size(size, zoom, scale)
+
+    # Flips mirror the pixel centers of the cropped image
+    sx, tx = (-1, output_size[0] + left) if flip in ('X', 'Both') else (1, left)
+    sy, ty = (-1, output_size[1] + top) if flip in ('Y', 'Both') else (1, top)
+    return output_size, [a * sx, b * sy, a * tx + b * ty + c, d * sx, e * sy, d * tx + e * ty + f]
+
+
+def create_proxy(image: Image.Image, size: tuple[int, int]) -> tuple[Image.Image, float]:
+    """
+    Create a downscaled copy of the image that still covers the given size,
+    used to preview edits without processing every pixel of the original.
+
+    Args:
+        image (Image.Image): The full-resolution image.
+        size (tuple[int, int]): The (width, height) the proxy must cover.
+
+    Returns:
+        tuple[Image.Image, float]: The proxy image and its scale relative to
+        the original. If the original is not larger than ``size``, it is
+        returned unchanged with a scale of 1.0.
+    """
+    scale = min(1.0, max(size[0] / image.size[0], size[1] / image.size[1]))
+    if scale >= 1.0:
+        return image, 1.0
+
+    proxy_size = (
+        max(1, round(image.size[0] * scale)),
+        max(1, round(image.size[1] * scale)),
+    )
+    proxy = image.resize(proxy_size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return proxy, proxy.size[0] / image.size[0]
+
+
+def decode_reduced(image: Image.Image, size: tuple[int, int]) -> Image.Image:
+    """
+    Decode an opened image at the smallest resolution that still covers the
+    given size. JPEGs use DCT scaling during decoding (``Image.draft``),
+    other formats are decoded fully and then shrunk by an integer factor
+    with ``Image.reduce``.
+
+    Args:
+        image (Image.Image): Image returned by ``Image.open``, not yet loaded.
+        size (tuple[int, int]): The (width, height) the result must cover.
+
+    Returns:
+        Image.Image: The decoded image, at least as large as ``size`` unless
+        the original is smaller. Palette, bilevel and 16-bit images are
+        converted to a mode ``Image.reduce`` can average, see ``_reducible``.
+    """
+    if image.format == 'JPEG':
+        image.draft(image.mode, size)
+    image = _reducible(image)
+
+    factor = min(image.size[0] // max(1, size[0]), image.size[1] // max(1, size[1]))
+    if factor >= 2:
+        return image.reduce(factor)
+    image.load()
+    return image
+
+
+def _reducible(image: Image.Image) -> Image.Image:
+    # Image.reduce rejects palette, bilevel and 16-bit images, and averaging
+    # the indices of 'PA' images would give meaningless colors
+    if image.mode in ('P', 'PA'):
+        has_alpha = image.mode == 'PA' or 'transparency' in image.info
+        return image.convert('RGBA' if has_alpha else 'RGB')
+    if image.mode == '1':
+        return image.convert('L')
+    if image.mode.startswith('I;16'):
+        return image.convert('I')
+    return image
+
+
+def load_proxy(path: str, size: tuple[int, int]) -> tuple[Image.Image, float]:
+    """
+    Load a preview proxy of an image file without decoding it at full
+    resolution, see ``decode_reduced`` and ``create_proxy``.
+
+    Args:
+        path (str): Path of the image file.
+        size (tuple[int, int]): The (width, height) the proxy must cover.
+
+    Returns:
+        tuple[Image.Image, float]: The proxy image and its scale relative to
+        the full-resolution original.
+    """
+    image = Image.open(path)
+    full_width = image.size[0]
+    proxy, _ = create_proxy(decode_reduced(image, size), size)
+    return proxy, proxy.size[0] / full_width
@@ -0,0 +1,188 @@
+"""
+Module providing the export manifest, a record kept in the output directory of
+what every exported file was produced from, so that re-running an export only
+processes the images whose original, recipe or encoder settings changed.
+
+Sharded exports (see ``tools.batch``) keep one manifest per shard, so that
+shards running at the same time never write the same file, and merge them
+into the directory's manifest once every shard is done.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Iterable, Optional
+from tools.thumbnail_cache import atomic_write, file_hash
+
+MANIFEST_NAME = '.export_manifest.json'
+MANIFEST_VERSION = 1
+SAVE_INTERVAL = 50    # recorded exports between two writes of the manifest
+
+
+def shard_manifest_name(index: int, count: int) -> str:
+    """
+    Get the file name of the manifest of a shard, e.g.
+    '.export_manifest.shard-3-of-16.json' for the third of 16 shards.
+    """
+    base, extension = os.path.splitext(MANIFEST_NAME)
+    return '{}.shard-{}-of-{}{}'.format(base, index, count, extension)
+
+
+class ExportManifest:
+    """
+    Manifest of the files exported to a directory, keyed by output file name.
+    Each entry holds the original's path, size, modification time and content
+    hash, the recipe hash and the encoder settings used for the export.
+    """
+    def __init__(self, output_dir: str, name: str = MANIFEST_NAME) -> None:
+        """
+        Load the manifest of a directory, starting empty if there is none.
+
+        Args:
+            output_dir (str): The export directory.
+            name (str, optional): File name of the manifest. Defaults to
+            ``MANIFEST_NAME``.
+        """
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, name)
+        self.entries = {}
+        # Set once every image of the export was processed, cleared when
+        # an export starts, so an interrupted export is not complete
+        self.complete = False
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+        try:
+            with open(self.path) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.entries = manifest['outputs']
+                self.complete = manifest.get('complete', False)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def is_up_to_date(self, source: str, output: str, recipe_hash: str,
+                      encoder: dict[str, Any], match_path: bool = True) -> bool:
+        """
+        Check whether an output was exported from the current version of its
+        original, with the same recipe and encoder settings. The original is
+        only hashed when its path, size or modification time changed.
+
+        Args:
+            source (str): Path of the original image.
+            output (str): Path of the exported image.
+            recipe_hash (str): ``EditRecipe.content_hash`` of the export recipe.
+            encoder (dict[str, Any]): Encoder settings of the export.
+            match_path (bool, optional): Require the original to be at the
+            recorded path. When False, an original read from another mount of
+            the same folder matches by its contents. Defaults to True.
+
+        Returns:
+            bool: True if exporting the image again would give the same file.
+        """
+        entry = self.entries.get(os.path.basename(output))
+        if entry is None or not os.path.exists(output):
+            return False
+        if entry['recipe_hash'] != recipe_hash or entry['encoder'] != encoder:
+            return False
+        same_path = entry['source'] == os.path.abspath(source)
+        if match_path and not same_path:
+            return False
+
+        stat = os.stat(source)
+        if stat.st_size != entry['source_size']:
+            return False
+        if same_path and stat.st_mtime_ns == entry['source_mtime_ns']:
+            return True
+
+        # Touched or moved but possibly unchanged, compare the contents
+        if file_hash(source) != entry['source_hash']:
+            return False
+        if same_path:
+            with self._lock:
+                entry['source_mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def record(self, source: str, output: str, recipe_hash: str,
+               encoder: dict[str, Any], source_hash: Optional[str] = None) -> None:
+        """
+        Record a successful export. The manifest is saved every
+        ``SAVE_INTERVAL`` records, so that an interrupted export keeps most
+        of its progress.
+
+        Args:
+            source (str): Path of the original image.
+            output (str): Path of the exported image.
+            recipe_hash (str): ``EditRecipe.content_hash`` of the export recipe.
+            encoder (dict[str, Any]): Encoder settings of the export.
+            source_hash (str, optional): Content hash of the original, computed
+            if not provided.
+        """
+        stat = os.stat(source)
+        entry = {
+            'source': os.path.abspath(source),
+            'source_size': stat.st_size,
+            'source_mtime_ns': stat.st_mtime_ns,
+            'source_hash': source_hash or file_hash(source),
+            'recipe_hash': recipe_hash,
+            'encoder': encoder,
+        }
+        with self._lock:
+            self.entries[os.path.basename(output)] = entry
+            self._unsaved += 1
+            save = self._unsaved >= SAVE_INTERVAL
+        if save:
+            self.save()
+
+    def prune(self, kept_outputs: Iterable[str]) -> list[str]:
+        """
+        Delete the recorded outputs that are not in ``kept_outputs``, e.g.
+        exports of originals that were removed. Files the manifest does not
+        know about are never deleted.
+
+        Args:
+            kept_outputs (Iterable[str]): Paths of the outputs to keep.
+
+        Returns:
+            list[str]: Paths of the deleted files.
+        """
+        kept = {os.path.basename(output) for output in kept_outputs}
+        removed = []
+        with self._lock:
+            for name in [name for name in self.entries if name not in kept]:
+                path = os.path.join(self.output_dir, name)
+                try:
+                    os.unlink(path)
+                    removed.append(path)
+                except FileNotFoundError:
+                    pass
+                del self.entries[name]
+                self._unsaved += 1
+        return removed
+
+    def merge(self, other: 'ExportManifest') -> None:
+        """
+        Add the entries of another manifest of the same directory, e.g. the
+        manifest of a shard, replacing the entries of the same outputs.
+        """
+        with self._lock:
+            self.entries.update(other.entries)
+            self._unsaved += len(other.entries)
+
+    def save(self) -> None:
+        """
+        Atomically write the manifest to the output directory.
+        """
+        with self._lock:
+            manifest = {
+                'version': MANIFEST_VERSION,
+                'complete': self.complete,
+                'outputs': dict(self.entries),
+            }
+            self._unsaved = 0
+        atomic_write(
+            self.path,
+            lambda manifest_file: manifest_file.write(
+                json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8')
+            ),
+        )
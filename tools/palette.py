@@ -0,0 +1,97 @@
+"""
+Module providing the extraction of the dominant colors of an image.
+
+Colors are counted on a small sample of the image, taken with nearest
+neighbour subsampling so that the cost does not depend on the image
+resolution, in a histogram of 32 levels per channel computed with NumPy.
+The most populated bins are returned with the mean color of their pixels,
+skipping bins too close to a more frequent color.
+"""
+
+from typing import Hashable
+import numpy as np
+from PIL import Image
+from tools.cache import ImageLRU
+from tools.quantize import PALETTE_SAMPLE_SIDE, sample_image
+
+# Bits kept per channel for the histogram bins
+HISTOGRAM_BITS = 5
+
+# Minimum distance between two extracted colors, in RGB levels
+MIN_COLOR_DISTANCE = 32
+
+# Number of extracted palettes kept by cached_palette
+PALETTE_CACHE_ITEMS = 32
+
+
+def sample_pixels(image: Image.Image, side: int = PALETTE_SAMPLE_SIDE) -> np.ndarray:
+    """
+    Subsample an image to at most ``side`` pixels on its long side.
+
+    Args:
+        image (Image.Image): The sampled image.
+        side (int, optional): Long side of the sample. Defaults to
+        ``PALETTE_SAMPLE_SIDE``.
+
+    Returns:
+        np.ndarray: The RGB values of the sampled pixels, as an (N, 3) array.
+        Fully transparent pixels are left out.
+    """
+    pixels = np.asarray(sample_image(image, side, 'RGBA')).reshape(-1, 4)
+    return pixels[pixels[:, 3] > 0, :3]
+
+
+def extract_palette(image: Image.Image, count: int = 6) -> list[tuple[tuple[int, int, int], float]]:
+    """
+    Extract the most frequent colors of an image.
+
+    Args:
+        image (Image.Image): The image, in any mode.
+        count (int, optional): Maximum number of colors. Defaults to 6.
+
+    Returns:
+        list[tuple[tuple[int, int, int], float]]: The (r, g, b) colors and the
+        proportion of the pixels they represent, most frequent first.
+    """
+    pixels = sample_pixels(image)
+    if not len(pixels):
+        return []
+
+    shift = 8 - HISTOGRAM_BITS
+    bins = pixels >> shift
+    index = (bins[:, 0].astype(np.int32) << (2 * HISTOGRAM_BITS)) | \
+            (bins[:, 1].astype(np.int32) << HISTOGRAM_BITS) | bins[:, 2]
+
+    length = 1 << (3 * HISTOGRAM_BITS)
+    counts = np.bincount(index, minlength=length)
+    sums = np.stack([
+        np.bincount(index, weights=pixels[:, channel], minlength=length) for channel in range(3)
+    ], axis=1)
+
+    palette = []
+    for bin_index in np.argsort(counts)[::-1]:
+        if counts[bin_index] == 0 or len(palette) == count:
+            break
+        color = sums[bin_index] / counts[bin_index]
+        if all(np.linalg.norm(color - chosen) >= MIN_COLOR_DISTANCE for chosen, _ in palette):
+            palette.append((color, counts[bin_index] / len(pixels)))
+
+    return [(tuple(int(round(value)) for value in color), float(proportion))
+            for color, proportion in palette]
+
+
+# Palettes are counted as one entry each, the budget is a number of entries
+_cache = ImageLRU(PALETTE_CACHE_ITEMS, PALETTE_CACHE_ITEMS)
+
+
+def cached_palette(key: Hashable, image: Image.Image,
+                   count: int = 6) -> list[tuple[tuple[int, int, int], float]]:
+    """
+    Same as ``extract_palette``, reusing the result of a previous call with
+    the same key, e.g. the image path and the edit recipe.
+    """
+    palette = _cache.get((key, count))
+    if palette is None:
+        palette = extract_palette(image, count)
+        _cache.put((key, count), palette, 1)
+    return palette
@@ -0,0 +1,214 @@
+"""
+Module providing fast implementations of the per-pixel color edits:
+the fused color stage (brightness, saturation, grayscale and color inversion)
+and the hue shift.
+
+The enabled edits are reduced to a single operation over the pixels:
+
+- When no intermediate result can leave the [0, 255] range (brightness and
+  saturation both between 0 and 1), the edits are linear and are composed into
+  one color matrix plus offset, applied by ``Image.convert`` in a single pass.
+  Pillow rounds the matrix result once instead of truncating after every
+  stage, so the output may differ from the chained stages by up to 2 per
+  channel.
+- Otherwise, brightness and inversion are folded into 256-entry lookup tables
+  applied with ``Image.point``, and only saturation needs its own pass. This
+  path gives exactly the same result as chaining ``ImageEnhance.Brightness``,
+  ``ImageEnhance.Color``, ``ImageOps.grayscale`` and ``ImageOps.invert``.
+"""
+
+from typing import Optional
+from PIL import Image, ImageEnhance
+import numpy as np
+
+# Image modes handled by the fused kernel, other modes use the Pillow stages
+SUPPORTED_MODES = ('L', 'RGB', 'RGBA')
+INVERTIBLE_MODES = ('L', 'RGB')
+
+# ITU-R 601-2 luma weights, as used by Pillow to convert RGB to L
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+IDENTITY_LUT = list(range(256))
+INVERT_LUT = IDENTITY_LUT[::-1]
+
+# RGB to YIQ color space, used to rotate the hue around the luma axis
+YIQ_MATRIX = np.array([
+    [0.299,  0.587,  0.114],
+    [0.596, -0.274, -0.322],
+    [0.211, -0.523,  0.312],
+])
+HUE_METHODS = ('hsv', 'yiq')
+
+
+def brightness_lut(factor: float) -> list[int]:
+    """
+    Build the lookup table of blending each value with black, which is how
+    ``ImageEnhance.Brightness`` changes the brightness.
+
+    Args:
+        factor (float): The brightness factor.
+
+    Returns:
+        list[int]: 256 values in the [0, 255] range.
+    """
+    # Image.blend computes in single precision, truncates, then clips
+    values = np.float32(factor) * np.arange(256, dtype=np.float32)
+    return np.clip(values, 0, 255).astype(np.uint8).tolist()
+
+
+def color_matrix(brightness: float, saturation: float,
+                 grayscale: bool, invert: bool) -> Optional[tuple[float, ...]]:
+    """
+    Compose the color edits into a matrix for ``Image.convert``.
+
+    Args:
+        brightness (float): Brightness factor.
+        saturation (float): Saturation factor.
+        grayscale (bool): Convert the image to grayscale.
+        invert (bool): Invert the image colors.
+
+    Returns:
+        tuple[float, ...]: 4 values (to 'L') or 12 values (to 'RGB'), or None
+        if the edits are not linear because intermediate values get clipped.
+    """
+    if not (0 <= brightness <= 1 and 0 <= saturation <= 1):
+        return None
+
+    if grayscale:
+        # Saturation keeps the luma of every pixel unchanged
+        rows = [[brightness * weight for weight in LUMA_WEIGHTS]]
+    else:
+        rows = [
+            [
+                brightness * ((1 - saturation) * weight + (saturation if row == col else 0))
+                for col, weight in enumerate(LUMA_WEIGHTS)
+            ]
+            for row in range(3)
+        ]
+
+    matrix = []
+    for row in rows:
+        if invert:
+            matrix += [-coefficient for coefficient in row] + [255]
+        else:
+            matrix += row + [0]
+    return tuple(matrix)
+
+
+def apply_color_ops(image: Image.Image, brightness: float, saturation: float,
+                    grayscale: bool, invert: bool) -> Image.Image:
+    """
+    Apply brightness, saturation, grayscale and inversion, in this order,
+    in as few passes over the pixels as possible.
+
+    Args:
+        image (Image.Image): Image in one of ``SUPPORTED_MODES``.
+        brightness (float): Brightness factor, 1 leaves the image unchanged.
+        saturation (float): Saturation factor, 1 leaves the image unchanged.
+        grayscale (bool): Convert the image to grayscale.
+        invert (bool): Invert the image colors.
+
+    Returns:
+        Image.Image: The edited image.
+
+    Raises:
+        OSError: If ``invert`` is set but the colors of the resulting image
+        cannot be inverted, as with ``ImageOps.invert``.
+    """
+    if invert and not grayscale and image.mode not in INVERTIBLE_MODES:
+        raise OSError(f'not supported for mode {image.mode}')
+
+    # Saturation is a no-op on grayscale images
+    if image.mode == 'L':
+        saturation = 1
+
+    if image.mode == 'RGB' and (saturation != 1 or grayscale):
+        matrix = color_matrix(brightness, saturation, grayscale, invert)
+        if matrix is not None:
+            return image.convert('L' if grayscale else 'RGB', matrix)
+
+    lut = brightness_lut(brightness)
+    if saturation == 1 and not grayscale:
+        if invert:
+            lut = [INVERT_LUT[value] for value in lut]
+        return image.point(_band_luts(image, lut))
+
+    if brightness != 1:
+        image = image.point(_band_luts(image, lut))
+    if saturation != 1:
+        image = ImageEnhance.Color(image).enhance(saturation)
+    if grayscale:
+        image = image.convert('L')
+    if invert:
+        image = image.point(INVERT_LUT * len(image.getbands()))
+    return image
+
+
+def _band_luts(image: Image.Image, lut: list[int]) -> list[int]:
+    # Apply the LUT to the color bands and leave alpha unchanged, like the
+    # blends in ImageEnhance which keep the alpha of the original.
+    luts = []
+    for band in image.getbands():
+        luts += IDENTITY_LUT if band == 'A' else lut
+    return luts
+
+
+def hue_matrix(shift: int) -> tuple[float, ...]:
+    """
+    Build the RGB color matrix rotating the hue by ``shift`` in YIQ space.
+
+    Args:
+        shift (int): Hue shift, in Pillow HSV hue units (256 per full turn).
+
+    Returns:
+        tuple[float, ...]: 12 values for ``Image.convert('RGB', matrix)``.
+    """
+    # Rotating the IQ plane clockwise matches increasing the HSV hue
+    angle = -2 * np.pi * shift / 256
+    rotation = np.array([
+        [1, 0,              0],
+        [0, np.cos(angle), -np.sin(angle)],
+        [0, np.sin(angle),  np.cos(angle)],
+    ])
+    matrix = np.linalg.inv(YIQ_MATRIX) @ rotation @ YIQ_MATRIX
+    return tuple(np.hstack([matrix, np.zeros((3, 1))]).ravel().tolist())
+
+
+def shift_hue(image: Image.Image, shift: int, method: str = 'hsv') -> Image.Image:
+    """
+    Shift the hue of every pixel, wrapping around the color wheel.
+
+    The 'hsv' method shifts the H channel of Pillow's HSV conversion through
+    a lookup table, giving the same result as editing the split H channel.
+    The 'yiq' method rotates the colors around the luma axis with a single
+    color matrix pass, several times faster but only an approximation of the
+    HSV shift (about 10 levels of mean difference per channel).
+
+    Args:
+        image (Image.Image): The edited image. Grayscale ('L') images have no
+        hue, they are only converted to 'RGB', as by the HSV round trip. The
+        alpha band of 'RGBA' and 'LA' images is kept, which the HSV round trip
+        dropped.
+        shift (int): Hue shift, in Pillow HSV hue units (256 per full turn).
+        method (str, optional): One of ``HUE_METHODS``. Defaults to 'hsv'.
+
+    Returns:
+        Image.Image: The edited image, in 'RGB' or 'RGBA' mode.
+    """
+    if method not in HUE_METHODS:
+        raise ValueError(f'unknown hue method {method!r}, expected one of {HUE_METHODS}')
+    if image.mode == 'L':
+        return image.convert('RGB')
+
+    alpha = image.getchannel('A') if 'A' in image.getbands() else None
+
+    if method == 'yiq':
+        rgb = image if image.mode == 'RGB' else image.convert('RGB')
+        result = rgb.convert('RGB', hue_matrix(shift))
+    else:
+        hue_lut = [(value + shift) % 256 for value in IDENTITY_LUT]
+        result = image.convert('HSV').point(hue_lut + IDENTITY_LUT * 2).convert('RGB')
+
+    if alpha is not None:
+        result.putalpha(alpha)
+    return result
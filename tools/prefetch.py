@@ -0,0 +1,108 @@
+"""
+Module responsible for decoding preview proxies ahead of time, so that
+stepping to the next or previous image of a batch does not wait for a decode.
+
+Proxies are cached per file: a cached proxy serves every size it covers,
+downscaled if it is larger than needed, so that neighbours with another
+aspect ratio and small window resizes still hit the cache.
+"""
+
+import threading
+from typing import Callable, Iterable
+from PIL import Image
+from tools.cache import ImageLRU, image_nbytes
+from tools.image_editor import create_proxy
+
+
+class ProxyPrefetcher:
+    """
+    Memory-bounded LRU of decoded preview proxies, filled on demand or ahead of
+    time by a worker thread.
+    """
+    def __init__(self, load: Callable[[str, tuple[int, int]], tuple[Image.Image, float]],
+                 max_bytes: int) -> None:
+        """
+        Args:
+            load (Callable[[str, tuple[int, int]], tuple[Image.Image, float]]):
+            Decodes the proxy of an image file covering a size, and returns it
+            with its scale, e.g. ``ThumbnailCache.load_proxy``. Must be safe to
+            call from several threads.
+            max_bytes (int): Memory budget of the decoded proxies.
+        """
+        self.load = load
+        self.cache = ImageLRU(max_bytes)
+        self._condition = threading.Condition()
+        self._pending = []    # (path, size) to decode, most wanted first
+        self._worker = None
+
+    def get(self, path: str, size: tuple[int, int]) -> tuple[Image.Image, float]:
+        """
+        Get the proxy of an image, decoding it now if it was not prefetched.
+
+        Args:
+            path (str): Path of the image file.
+            size (tuple[int, int]): The (width, height) the proxy must cover.
+
+        Returns:
+            tuple[Image.Image, float]: The proxy and its scale.
+        """
+        cached = self.cache.get(path)
+        if cached is not None and covers(cached, size):
+            proxy, scale = cached
+            reduced, _ = create_proxy(proxy, size)
+            return reduced, scale * reduced.size[0] / proxy.size[0]
+
+        proxy = self.load(path, size)
+        self.cache.put(path, proxy, image_nbytes(proxy[0]))
+        return proxy
+
+    def prefetch(self, paths: Iterable[str], size: tuple[int, int]) -> None:
+        """
+        Decode the proxies of images on the worker thread, replacing the
+        previous prefetch requests that have not started yet.
+
+        Args:
+            paths (Iterable[str]): Paths of the images, most wanted first.
+            size (tuple[int, int]): The (width, height) the proxies must cover.
+        """
+        with self._condition:
+            self._pending = [(path, tuple(size)) for path in paths if not self._is_cached(path, size)]
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._condition.notify()
+
+    def _run(self) -> None:
+        # Worker thread loop, decoding the most wanted pending proxy.
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                path, size = self._pending.pop(0)
+
+            if self._is_cached(path, size):
+                continue
+            try:
+                proxy = self.load(path, size)
+            except Exception:
+                # Reported when the image is actually opened
+                continue
+            self.cache.put(path, proxy, image_nbytes(proxy[0]))
+
+    def _is_cached(self, path: str, size: tuple[int, int]) -> bool:
+        # Whether a cached proxy of the file can serve the size
+        cached = self.cache.get(path)
+        return cached is not None and covers(cached, size)
+
+
+def covers(proxy: tuple[Image.Image, float], size: tuple[int, int]) -> bool:
+    """
+    Tell if a proxy can be used for the given size: it covers it, or it is
+    the original image, which cannot cover more.
+
+    Args:
+        proxy (tuple[Image.Image, float]): The proxy and its scale.
+        size (tuple[int, int]): The (width, height) the proxy must cover.
+    """
+    image, scale = proxy
+    return scale == 1.0 or (image.size[0] >= size[0] and image.size[1] >= size[1])
@@ -0,0 +1,86 @@
+"""
+Module providing the display pyramid of a rendered image: successive halvings
+of the image, so that displaying it at any size only resamples the nearest
+larger level instead of the full image, and a cache of the displayed images
+per canvas size.
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable
+from PIL import Image
+
+# Levels are halved until their long side is below this size
+MIN_LEVEL_SIDE = 256
+
+# Number of display sizes kept per image
+DISPLAY_CACHE_ITEMS = 8
+
+
+class DisplayPyramid:
+    """
+    Multi-resolution copies of an image, built lazily. Not thread-safe,
+    meant to be used from the Tk main thread.
+    """
+    def __init__(self, image: Image.Image, max_cached: int = DISPLAY_CACHE_ITEMS) -> None:
+        """
+        Args:
+            image (Image.Image): The full-size level.
+            max_cached (int, optional): Number of display sizes kept by
+            ``photo``. Defaults to ``DISPLAY_CACHE_ITEMS``.
+        """
+        self.levels = [image]
+        self.max_cached = max_cached
+        self._photos = OrderedDict()
+
+    def level_for(self, size: tuple[int, int]) -> Image.Image:
+        """
+        Get the smallest level at least as large as ``size``, or the full-size
+        level if ``size`` is larger than the image.
+        """
+        while True:
+            level = self.levels[-1]
+            half = ((level.size[0] + 1) // 2, (level.size[1] + 1) // 2)
+            if half[0] < size[0] or half[1] < size[1]:
+                break
+            if max(level.size) < MIN_LEVEL_SIDE:
+                break
+            self.levels.append(level.reduce(2) if level.mode in ('L', 'RGB', 'RGBA') else
+                               level.resize(half, Image.BOX))
+
+        for level in reversed(self.levels):
+            if level.size[0] >= size[0] and level.size[1] >= size[1]:
+                return level
+        return self.levels[0]
+
+    def resized(self, size: tuple[int, int]) -> Image.Image:
+        """
+        Resample the image to ``size`` from the nearest larger level.
+        """
+        level = self.level_for(size)
+        if level.size == tuple(size):
+            return level
+        return level.resize(size, Image.BILINEAR)
+
+    def photo(self, size: tuple[int, int], make_photo: Callable[[Image.Image], Any]) -> Any:
+        """
+        Get the image displayed at ``size``, reusing the one made for a
+        previous request of the same size.
+
+        Args:
+            size (tuple[int, int]): The displayed (width, height).
+            make_photo (Callable[[Image.Image], Any]): Makes the displayed object
+            from the resized image, e.g. ``ImageTk.PhotoImage``.
+
+        Returns:
+            Any: The object returned by ``make_photo``.
+        """
+        size = (max(1, int(size[0])), max(1, int(size[1])))
+        if size in self._photos:
+            self._photos.move_to_end(size)
+            return self._photos[size]
+
+        photo = make_photo(self.resized(size))
+        self._photos[size] = photo
+        while len(self._photos) > self.max_cached:
+            self._photos.popitem(last=False)
+        return photo
@@ -0,0 +1,129 @@
+"""
+Module providing the quantizer of the 4-color filter.
+
+The palette is computed from a small sample of the image (256 pixels on its
+long side, picked with nearest-neighbour resampling so that the tiled mode
+can gather the same pixels tile by tile), and cached by the contents of the
+sample, so that preview
+refreshes that do not change the colors before the filter reuse it. The
+pixels of the image are then mapped to the palette with Pillow's palette
+conversion, and converted back to the mode of the image, so that the later
+stages do not have to handle palette images.
+
+Pillow looks the nearest palette color up in a color cube of reduced
+precision: about 1% of the pixels, those almost equally close to two
+palette colors, may get the second nearest one. An exact NumPy lookup was
+more than 10 times slower.
+"""
+
+import xxhash
+from PIL import Image
+from tools.cache import ImageLRU
+
+QUANTIZE_METHODS = ('median-cut', 'k-means', 'octree')
+
+# Long side of the sample the palette is computed from
+PALETTE_SAMPLE_SIDE = 256
+
+# Refinement passes of the 'k-means' method, starting from the median cut
+KMEANS_ITERATIONS = 8
+
+# Number of palettes kept by compute_palette
+PALETTE_CACHE_ITEMS = 64
+
+_PILLOW_METHODS = {
+    'median-cut': (Image.Quantize.MEDIANCUT, 0),
+    'k-means':    (Image.Quantize.MEDIANCUT, KMEANS_ITERATIONS),
+    'octree':     (Image.Quantize.FASTOCTREE, 0),
+}
+
+# Palettes are counted as one entry each, the budget is a number of entries
+_cache = ImageLRU(PALETTE_CACHE_ITEMS, PALETTE_CACHE_ITEMS)
+
+
+def sample_size(size: tuple[int, int], side: int = PALETTE_SAMPLE_SIDE) -> tuple[int, int]:
+    """
+    Get the size of the sample of an image, at most ``side`` pixels on its long side.
+    """
+    factor = max(size) / side
+    if factor > 1:
+        return (max(1, round(size[0] / factor)), max(1, round(size[1] / factor)))
+    return size
+
+
+def sample_image(image: Image.Image, side: int = PALETTE_SAMPLE_SIDE,
+                 mode: str = 'RGB') -> Image.Image:
+    """
+    Downscale an image to at most ``side`` pixels on its long side, in the
+    given mode, keeping a subset of its pixels.
+    """
+    size = sample_size(image.size, side)
+    if size != image.size:
+        image = image.resize(size, Image.NEAREST)
+    return image.convert(mode)
+
+
+def compute_palette(image: Image.Image, colors: int = 4, method: str = 'median-cut') -> Image.Image:
+    """
+    Compute a palette representing the colors of an image, from a sample.
+
+    Args:
+        image (Image.Image): The image, in any mode.
+        colors (int, optional): Number of palette colors. Defaults to 4.
+        method (str, optional): One of ``QUANTIZE_METHODS``. Defaults to
+        'median-cut'.
+
+    Returns:
+        Image.Image: A palette image, for ``map_to_palette``.
+    """
+    if method not in QUANTIZE_METHODS:
+        raise ValueError(f'unknown quantize method {method!r}, expected one of {QUANTIZE_METHODS}')
+
+    sample = sample_image(image)
+    key = (xxhash.xxh3_128_hexdigest(sample.tobytes()), sample.size, colors, method)
+    palette = _cache.get(key)
+    if palette is None:
+        pillow_method, kmeans = _PILLOW_METHODS[method]
+        palette = sample.quantize(colors, pillow_method, kmeans)
+        _cache.put(key, palette, 1)
+    return palette
+
+
+def map_to_palette(image: Image.Image, palette: Image.Image, dither: bool = False) -> Image.Image:
+    """
+    Replace every pixel of an image with the nearest palette color.
+
+    Args:
+        image (Image.Image): The image, in any mode.
+        palette (Image.Image): A palette image, from ``compute_palette``.
+        dither (bool, optional): Diffuse the quantization error with
+        Floyd-Steinberg dithering. Defaults to False.
+
+    Returns:
+        Image.Image: The quantized image, in 'L' mode for 'L' images, 'RGBA'
+        for 'RGBA' images (keeping the alpha band), 'RGB' otherwise.
+    """
+    dither_mode = Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE
+    result = image.convert('RGB').quantize(palette=palette, dither=dither_mode).convert('RGB')
+
+    if image.mode == 'L':
+        return result.convert('L')
+    if image.mode == 'RGBA':
+        result.putalpha(image.getchannel('A'))
+    return result
+
+
+def four_color(image: Image.Image, method: str = 'median-cut', dither: bool = False) -> Image.Image:
+    """
+    Display an image with only 4 colors, extracted from the image.
+
+    Args:
+        image (Image.Image): The image, in any mode.
+        method (str, optional): One of ``QUANTIZE_METHODS``. Defaults to
+        'median-cut'.
+        dither (bool, optional): Dither the result. Defaults to False.
+
+    Returns:
+        Image.Image: The quantized image, see ``map_to_palette``.
+    """
+    return map_to_palette(image, compute_palette(image, 4, method), dither)
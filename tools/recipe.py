@@ -0,0 +1,111 @@
+"""
+Module providing the edit recipe, an immutable snapshot of every edit value.
+"""
+
+import hashlib
+import json
+from dataclasses import asdict, dataclass, fields
+from typing import Any
+from defaults import *
+
+# GUI variable names that differ from the recipe field names
+VARIABLE_FIELDS = {'4-color': 'four_color'}
+
+
+@dataclass(frozen=True, slots=True)
+class EditRecipe:
+    """
+    Values of all the edits applied by ``ImageEditor``, independent of the GUI
+    so that it can be pickled, saved, hashed and replayed.
+    """
+    rotation: float = ROTATION_DEFAULT
+    zoom: float = ZOOM_DEFAULT
+    flip: str = FLIP_AXIS_OPTIONS[0]
+    brightness: float = BRIGHTNESS_DEFAULT
+    saturation: float = SATURATION_DEFAULT
+    grayscale: bool = GRAYSCALE_DEFAULT
+    invert: bool = INVERT_DEFAULT
+    four_color: bool = FOUR_COLOR_DEFAULT
+    blur: float = BLUR_DEFAULT
+    contrast: float = CONTRAST_DEFAULT
+    hue: int = HUE_DEFAULT
+
+    def __post_init__(self) -> None:
+        # Normalize the types, so that equal edits compare and hash equally
+        # whatever the GUI variable or JSON number types were
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if field.type is float:
+                value = float(value)
+            elif field.type is int:
+                value = int(round(value))
+            elif field.type is bool:
+                value = bool(value)
+            object.__setattr__(self, field.name, value)
+
+        if self.flip not in FLIP_AXIS_OPTIONS:
+            raise ValueError(f'flip must be one of {FLIP_AXIS_OPTIONS}, got {self.flip!r}')
+
+    @classmethod
+    def from_variables(cls, *variable_dicts: dict[str, Any]) -> 'EditRecipe':
+        """
+        Snapshot the current values of the GUI variables.
+
+        Args:
+            variable_dicts (dict[str, Any]): Dictionaries of ctk variables,
+            keyed by edit name.
+
+        Returns:
+            EditRecipe: The recipe holding the variables' values.
+        """
+        values = {}
+        for variables in variable_dicts:
+            for name, variable in variables.items():
+                values[VARIABLE_FIELDS.get(name, name)] = variable.get()
+        return cls(**values)
+
+    @classmethod
+    def from_dict(cls, values: dict[str, Any]) -> 'EditRecipe':
+        """
+        Build a recipe from a dictionary, missing values keep their defaults.
+
+        Args:
+            values (dict[str, Any]): Edit values keyed by field name.
+
+        Returns:
+            EditRecipe: The resulting recipe.
+        """
+        if not isinstance(values, dict):
+            raise ValueError('edit values must be an object, got {}'.format(type(values).__name__))
+        unknown = set(values) - {field.name for field in fields(cls)}
+        if unknown:
+            raise ValueError('unknown edit values: {}'.format(', '.join(sorted(unknown))))
+        return cls(**values)
+
+    @classmethod
+    def from_json(cls, text: str) -> 'EditRecipe':
+        """
+        Build a recipe from the JSON produced by ``to_json``.
+        """
+        return cls.from_dict(json.loads(text))
+
+    def to_dict(self) -> dict[str, Any]:
+        """
+        Get the recipe values keyed by field name.
+        """
+        return asdict(self)
+
+    def to_json(self) -> str:
+        """
+        Serialize the recipe to canonical JSON (sorted keys, no whitespace).
+        """
+        return json.dumps(self.to_dict(), sort_keys=True, separators=(',', ':'))
+
+    def content_hash(self) -> str:
+        """
+        Get a hash of the recipe values, stable across runs and machines.
+
+        Returns:
+            str: Hex digest of the SHA-256 of ``to_json``.
+        """
+        return hashlib.sha256(self.to_json().encode('utf-8')).hexdigest()
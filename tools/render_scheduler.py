@@ -0,0 +1,117 @@
+"""
+Module responsible for running preview renders off the Tk main thread.
+"""
+
+import threading
+import time
+from typing import Any, Callable
+from tools.image_editor import RenderCancelled
+
+
+class RenderScheduler:
+    """
+    Latest-wins render queue. Bursts of requests collapse into a single pending
+    job, which runs on a worker thread. Only frames newer than the last delivered
+    one are handed back to the Tk main thread, through ``after()``.
+    """
+    def __init__(self, widget: Any, on_done: Callable[[Any], None],
+                 poll_ms: int = 15, max_latency: float = 0.1) -> None:
+        """
+        Args:
+            widget (Any): Tk widget used to schedule callbacks on the main thread.
+            on_done (Callable[[Any], None]): Called on the main thread with the
+            result of the newest finished render.
+            poll_ms (int, optional): How often the main thread checks for finished
+            renders while work is outstanding. Defaults to 15.
+            max_latency (float, optional): Seconds after the last delivered frame
+            during which a running render is cancelled as soon as a newer one is
+            requested. Past that, the running render is allowed to finish so that
+            continuous slider drags still produce frames. Defaults to 0.1.
+        """
+        self.widget = widget
+        self.on_done = on_done
+        self.poll_ms = poll_ms
+        self.max_latency = max_latency
+
+        self._condition = threading.Condition()
+        self._generation = 0          # id of the newest requested render
+        self._pending = None          # (generation, render function) waiting to run
+        self._finished = None         # (generation, result, error) waiting to be delivered
+        self._delivered = 0           # id of the newest delivered render
+        self._delivered_at = time.monotonic()
+        self._polling = False
+        self._worker = None
+
+    def request(self, render: Callable[[Callable[[], bool]], Any]) -> None:
+        """
+        Schedule a render, replacing any render that has not started yet.
+        Must be called from the Tk main thread.
+
+        Args:
+            render (Callable[[Callable[[], bool]], Any]): Function doing the render.
+            It receives a callable reporting whether the render became stale, and
+            should raise ``RenderCancelled`` when it does.
+        """
+        with self._condition:
+            self._generation += 1
+            self._pending = (self._generation, render)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            self._condition.notify()
+
+        if not self._polling:
+            self._polling = True
+            self.widget.after(self.poll_ms, self._poll)
+
+    def _is_stale(self, generation: int) -> bool:
+        # A render is stale once a newer one is requested, unless the screen
+        # has not been refreshed for longer than ``max_latency``.
+        with self._condition:
+            superseded = generation < self._generation
+            overdue = time.monotonic() - self._delivered_at > self.max_latency
+        return superseded and not overdue
+
+    def _run(self) -> None:
+        # Worker thread loop, always picking up the newest pending render.
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                generation, render = self._pending
+                self._pending = None
+
+            result, error = None, None
+            try:
+                result = render(lambda: self._is_stale(generation))
+            except RenderCancelled:
+                continue
+            except Exception as exc:
+                # Re-raised on the main thread, where Tk reports callback errors
+                error = exc
+
+            with self._condition:
+                if self._finished is None or self._finished[0] < generation:
+                    self._finished = (generation, result, error)
+
+    def _poll(self) -> None:
+        # Deliver the newest finished frame on the main thread.
+        with self._condition:
+            finished, self._finished = self._finished, None
+            if finished is not None and finished[0] > self._delivered:
+                self._delivered = finished[0]
+                self._delivered_at = time.monotonic()
+            else:
+                finished = None
+            outstanding = self._delivered < self._generation
+
+        if outstanding:
+            self.widget.after(self.poll_ms, self._poll)
+        else:
+            self._polling = False
+
+        if finished is not None:
+            _, result, error = finished
+            if error is not None:
+                raise error
+            self.on_done(result)
@@ -0,0 +1,97 @@
+"""
+Module responsible for listing image folders off the Tk main thread, so that
+large or network-mounted folders do not freeze the window.
+"""
+
+import queue
+import threading
+from typing import Any, Callable, Optional
+from tools.batch import iter_image_paths
+
+# Queued by the worker thread once the scan is complete
+_SCAN_DONE = object()
+
+
+class DirectoryScanner:
+    """
+    Lists the images of a directory on a worker thread, and streams the found
+    paths to the Tk main thread in batches, through ``after()``.
+    """
+    def __init__(self, widget: Any, on_found: Callable[[list[str]], None],
+                 on_done: Optional[Callable[[Optional[Exception]], None]] = None,
+                 poll_ms: int = 50, batch_size: int = 256) -> None:
+        """
+        Args:
+            widget (Any): Tk widget used to schedule callbacks on the main thread.
+            on_found (Callable[[list[str]], None]): Called on the main thread with
+            each batch of found image paths.
+            on_done (Callable[[Optional[Exception]], None], optional): Called on
+            the main thread once the scan is over, with the error that stopped
+            it, if any. Defaults to None.
+            poll_ms (int, optional): How often the main thread checks for found
+            paths. Defaults to 50.
+            batch_size (int, optional): Maximum number of paths per batch.
+            Defaults to 256.
+        """
+        self.widget = widget
+        self.on_found = on_found
+        self.on_done = on_done
+        self.poll_ms = poll_ms
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._cancelled = threading.Event()
+
+    def start(self, directory: str) -> None:
+        """
+        Start listing a directory. Must be called from the Tk main thread.
+        """
+        threading.Thread(target=self._scan, args=(directory,), daemon=True).start()
+        self.widget.after(self.poll_ms, self._poll)
+
+    def cancel(self) -> None:
+        """
+        Stop the scan, no callback is called afterwards.
+        """
+        self._cancelled.set()
+
+    def _scan(self, directory: str) -> None:
+        # Worker thread, queueing batches of paths then the end of the scan.
+        batch, first, error = [], True, None
+        try:
+            for path in iter_image_paths(directory):
+                if self._cancelled.is_set():
+                    return
+                batch.append(path)
+                # The first image is sent alone, so that it can be opened right away
+                if first or len(batch) >= self.batch_size:
+                    self._queue.put(batch)
+                    batch, first = [], False
+        except OSError as exc:
+            error = exc
+        if batch:
+            self._queue.put(batch)
+        self._queue.put(error or _SCAN_DONE)
+
+    def _poll(self) -> None:
+        # Deliver the batches found since the last poll on the main thread.
+        if self._cancelled.is_set():
+            return
+
+        found, done, error = [], False, None
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, list):
+                found.extend(item)
+            else:
+                done, error = True, None if item is _SCAN_DONE else item
+                break
+
+        if not done:
+            self.widget.after(self.poll_ms, self._poll)
+        if found:
+            self.on_found(found)
+        if done and self.on_done is not None:
+            self.on_done(error)
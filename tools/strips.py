@@ -0,0 +1,115 @@
+"""
+Module providing strip-by-strip execution of the edits, so that editing an
+image allocates about one full-size image per stage at most, instead of the
+several full-size temporaries some Pillow operations use.
+
+Per-pixel edits (colors, hue, palette mapping) are written back into the
+edited image, strip by strip. Neighbourhood filters (blur, unsharp mask) read
+each strip with a halo of neighbouring rows and write it into a second image,
+the input being released once the stage is over: a chain of stages holds two
+full-size images at most, besides the source.
+
+Strips span the whole width of the image, and the halo is wide enough for
+the filter radius, so the results are identical to editing the whole image.
+"""
+
+import math
+from typing import Callable
+from PIL import Image
+
+# Pixels per strip, small enough for a strip to stay in the CPU caches
+STRIP_PIXELS = 256 * 1024
+
+# Extra rows per unit of filter radius around each strip. Pillow approximates
+# gaussians with three box blurs of about the radius each.
+HALO_PER_RADIUS = 3
+HALO_MARGIN = 4
+
+# Minimum height of the strips of filter_in_strips, in halos, so that the
+# halo rows do not make up most of the filtered pixels
+MIN_STRIP_HALOS = 16
+
+
+def halo_for_radius(radius: float) -> int:
+    """
+    Get the rows (or columns) of neighbours a gaussian-based filter of the
+    given radius needs to give the same result on a crop as on the whole image.
+    """
+    return math.ceil(HALO_PER_RADIUS * radius) + HALO_MARGIN if radius else 0
+
+
+def strip_rows(width: int, strip_pixels: int = STRIP_PIXELS) -> int:
+    """
+    Get the height of the strips of an image of the given width.
+    """
+    return max(1, strip_pixels // max(1, width))
+
+
+def edit_in_strips(image: Image.Image, edit: Callable[[Image.Image], Image.Image],
+                   strip_pixels: int = STRIP_PIXELS) -> Image.Image:
+    """
+    Apply a per-pixel edit to an image strip by strip, pasting each edited
+    strip back into the image, so that only a strip is allocated instead of a
+    second full-size image. Gives the same result as ``edit(image)``.
+
+    Args:
+        image (Image.Image): The image, modified in place, so it must not be
+        used anywhere else.
+        edit (Callable[[Image.Image], Image.Image]): The edit, e.g. a partial
+        of ``point_ops.apply_color_ops``. Each output pixel must only depend
+        on the input pixel at the same position.
+        strip_pixels (int, optional): Pixels per strip. Defaults to
+        ``STRIP_PIXELS``.
+
+    Returns:
+        Image.Image: ``image`` itself, or a new image if the edit changes the
+        image mode (e.g. to grayscale).
+    """
+    width, height = image.size
+    rows = strip_rows(width, strip_pixels)
+    output = image
+    for top in range(0, height, rows):
+        box = (0, top, width, min(height, top + rows))
+        strip = edit(image.crop(box))
+        if strip.mode != output.mode:
+            output = Image.new(strip.mode, image.size)
+        output.paste(strip, box[:2])
+    return output
+
+
+def filter_in_strips(image: Image.Image, edit: Callable[[Image.Image], Image.Image],
+                     halo: int, strip_pixels: int = STRIP_PIXELS) -> Image.Image:
+    """
+    Apply a neighbourhood filter to an image strip by strip, into a new image,
+    so that the filter only allocates temporaries for a strip. Gives the same
+    result as ``edit(image)``.
+
+    Args:
+        image (Image.Image): The image, left unchanged.
+        edit (Callable[[Image.Image], Image.Image]): The filter. Each output
+        pixel must only depend on the input pixels within ``halo`` rows, and
+        the filter must keep the image size.
+        halo (int): Rows of neighbours read above and below each strip, see
+        ``halo_for_radius``.
+        strip_pixels (int, optional): Pixels per strip, not counting the halo.
+        Defaults to ``STRIP_PIXELS``.
+
+    Returns:
+        Image.Image: The filtered image.
+    """
+    width, height = image.size
+    rows = max(strip_rows(width, strip_pixels), MIN_STRIP_HALOS * halo)
+    if rows >= height:
+        return edit(image)
+
+    output = None
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        # Strip with its halo, clipped to the image like the filters
+        region = (0, max(0, top - halo), width, min(height, bottom + halo))
+        strip = edit(image.crop(region))
+        strip = strip.crop((0, top - region[1], width, bottom - region[1]))
+        if output is None:
+            output = Image.new(strip.mode, image.size)
+        output.paste(strip, (0, top))
+    return output
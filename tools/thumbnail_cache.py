@@ -0,0 +1,247 @@
+"""
+Module providing a persistent, on-disk cache of preview proxies, so that
+images opened in a previous session are not decoded again at full size.
+
+Proxies are keyed by a content hash of the original file. The hash is only
+recomputed when the file's size or modification time changes, and the cache
+is kept under a size cap by evicting the least recently used proxies.
+"""
+
+import atexit
+import io
+import json
+import math
+import os
+import tempfile
+import threading
+import xxhash
+from PIL import Image
+from tools.image_editor import create_proxy, decode_reduced
+
+# Proxies are stored with their long side rounded up to a power of two, so that
+# small canvas size changes reuse the same file
+MIN_PROXY_SIDE = 256
+INDEX_NAME = 'index.json'
+INDEX_FLUSH_INTERVAL = 100    # index updates between two writes of the index file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Proxies are stored losslessly, so that a cache hit gives the same pixels as
+# decoding the original. Modes neither format stores exactly are not cached.
+PNG_MODES = ('1', 'L', 'LA', 'P', 'RGB', 'RGBA')
+TIFF_MODES = ('CMYK', 'I', 'F', 'LAB')
+
+
+def file_hash(path: str) -> str:
+    """
+    Hash the contents of a file with xxHash (XXH3, 128 bits).
+
+    Args:
+        path (str): Path of the hashed file.
+
+    Returns:
+        str: Hex digest of the file contents.
+    """
+    digest = xxhash.xxh3_128()
+    with open(path, 'rb') as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomic_write(path: str, write) -> None:
+    """
+    Write a file through a temporary file in the same directory, replaced into
+    place once complete, so readers never see a partially written file.
+
+    Args:
+        path (str): Path of the written file.
+        write (Callable[[BinaryIO], None]): Writes the contents to a binary file.
+    """
+    directory, name = os.path.split(path)
+    handle, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + name, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            write(temp_file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class ThumbnailCache:
+    """
+    Content-addressed cache of downscaled images, stored in a directory.
+    Safe to use from several threads.
+    """
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        """
+        Args:
+            directory (str): Directory holding the cached proxies, created if missing.
+            max_bytes (int): Size cap for all the cached proxies together.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # path -> [size, mtime_ns, content hash, width, height] of the original
+        self._index = {}
+        self._index_updates = 0
+        try:
+            with open(os.path.join(directory, INDEX_NAME)) as index_file:
+                self._index = json.load(index_file)
+        except (OSError, ValueError):
+            pass
+
+        self._nbytes = sum(size for _, size, _ in self._entries())
+        atexit.register(self.flush)
+
+    def source_info(self, path: str) -> tuple[str, tuple[int, int]]:
+        """
+        Get the content hash and the full size of an image file, hashing
+        it only if it changed since it was last seen.
+
+        Args:
+            path (str): Path of the original image.
+
+        Returns:
+            tuple[str, tuple[int, int]]: Content hash and (width, height).
+        """
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        with self._lock:
+            entry = self._index.get(key)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2], (entry[3], entry[4])
+
+        content_hash = file_hash(path)
+        with Image.open(path) as image:
+            width, height = image.size
+
+        with self._lock:
+            self._index[key] = [stat.st_size, stat.st_mtime_ns, content_hash, width, height]
+            self._index_updates += 1
+            flush = self._index_updates >= INDEX_FLUSH_INTERVAL
+        if flush:
+            self.flush()
+        return content_hash, (width, height)
+
+    def load_proxy(self, path: str, size: tuple[int, int]) -> tuple[Image.Image, float]:
+        """
+        Get a preview proxy covering ``size``, from the cache if possible.
+        Same result as ``image_editor.load_proxy``, at the resolution of the
+        cached proxy.
+
+        Args:
+            path (str): Path of the original image.
+            size (tuple[int, int]): The (width, height) the proxy must cover.
+
+        Returns:
+            tuple[Image.Image, float]: The proxy image and its scale relative to
+            the full-resolution original.
+        """
+        content_hash, full_size = self.source_info(path)
+
+        # Long side of the stored proxy, covering the requested size
+        scale = min(1.0, max(size[0] / full_size[0], size[1] / full_size[1]))
+        long_side = max(full_size) * scale
+        stored_side = min(
+            max(full_size),
+            max(MIN_PROXY_SIDE, 2 ** math.ceil(math.log2(max(1.0, long_side)))),
+        )
+        stored_size = (
+            math.ceil(full_size[0] * stored_side / max(full_size)),
+            math.ceil(full_size[1] * stored_side / max(full_size)),
+        )
+        cache_path = os.path.join(self.directory, '{}_{}'.format(content_hash, stored_side))
+
+        proxy = self._read(cache_path)
+        if proxy is None:
+            proxy, _ = create_proxy(decode_reduced(Image.open(path), stored_size), stored_size)
+            self._write(cache_path, proxy)
+
+        proxy, _ = create_proxy(proxy, size)
+        return proxy, proxy.size[0] / full_size[0]
+
+    def flush(self) -> None:
+        """
+        Write the index of hashed files to disk, without the files that do not
+        exist anymore.
+        """
+        with self._lock:
+            paths = list(self._index)
+        stale = [path for path in paths if not os.path.exists(path)]
+        with self._lock:
+            for path in stale:
+                self._index.pop(path, None)
+            index = dict(self._index)
+            self._index_updates = 0
+        try:
+            atomic_write(
+                os.path.join(self.directory, INDEX_NAME),
+                lambda index_file: index_file.write(json.dumps(index).encode('utf-8')),
+            )
+        except OSError:
+            pass
+
+    def _read(self, cache_path: str):
+        # Load a cached proxy and mark it as recently used.
+        try:
+            with Image.open(cache_path) as cached:
+                cached.load()
+            os.utime(cache_path)
+            return cached
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, cache_path: str, proxy: Image.Image) -> None:
+        # Store a proxy, then evict the least recently used ones over the cap.
+        if proxy.mode in PNG_MODES:
+            save = lambda cache_file: proxy.save(cache_file, 'PNG', compress_level=1)
+        elif proxy.mode in TIFF_MODES:
+            save = lambda cache_file: proxy.save(cache_file, 'TIFF', compression='tiff_adobe_deflate')
+        else:
+            return
+
+        # Encoded outside the lock, the file is replaced and accounted under
+        # it, so that concurrent writes of the same proxy count it once
+        encoded = io.BytesIO()
+        try:
+            save(encoded)
+        except OSError:
+            return
+        data = encoded.getvalue()
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            try:
+                replaced_size = os.path.getsize(cache_path)
+            except OSError:
+                replaced_size = 0
+            try:
+                atomic_write(cache_path, lambda cache_file: cache_file.write(data))
+            except OSError:
+                return
+            self._nbytes += len(data) - replaced_size
+            if self._nbytes <= self.max_bytes:
+                return
+            for path, entry_size, _ in sorted(self._entries(), key=lambda entry: entry[2]):
+                if self._nbytes <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                    self._nbytes -= entry_size
+                except OSError:
+                    pass
+
+    def _entries(self):
+        # (path, size, last use) of every cached proxy.
+        entries = []
+        with os.scandir(self.directory) as scanned:
+            for entry in scanned:
+                if entry.name == INDEX_NAME or entry.name.startswith('.'):
+                    continue
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
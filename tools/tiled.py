@@ -0,0 +1,227 @@
+"""
+Module providing a tiled execution mode of the edit pipeline, for images too
+large to hold several full-size intermediate results in memory.
+
+The edited image is produced tile by tile: each tile samples its region of
+the source through the affine transform of the geometry stage, then runs the
+other stages of ``EDIT_STAGES`` with a halo of extra pixels wide enough for
+the blur and contrast radii, which is cropped away before the tile is
+written. Besides the decoded source, memory use is bounded by the tile size
+instead of the image size.
+
+Tiles give the same pixels as ``ImageEditor.apply`` with the 'gaussian' blur
+engine. The 'downsample' engine reduces the whole image on one grid, which
+tiles cannot share, so tiles always blur exactly.
+
+The palette of the 4-color filter is computed once, so that every tile is
+mapped to the same four colors: the pixels of its sample are rendered row by
+row through the geometry and color stages, which gives the sample
+``quantize.sample_image`` takes from the whole image. Dithering, if enabled,
+diffuses the quantization error within each tile, so dithered tiles differ
+from the whole image along their edges.
+"""
+
+import math
+from typing import Iterator
+import numpy as np
+from defaults import *
+from PIL import Image
+from tools.image_editor import ImageEditor, geometry_transform
+from tools.planner import EDIT_STAGES
+from tools.quantize import compute_palette, map_to_palette, sample_size
+from tools.recipe import EditRecipe
+from tools.strips import halo_for_radius
+
+
+def halo_size(recipe: EditRecipe, scale: float = 1.0) -> int:
+    """
+    Get the overlap needed around each tile so that the blur and contrast
+    stages see the same neighbours as on the whole image.
+
+    Args:
+        recipe (EditRecipe): The edit values.
+        scale (float, optional): Scale of the source relative to the original.
+        Defaults to 1.0.
+
+    Returns:
+        int: Halo width in pixels.
+    """
+    radius = 0.0
+    if recipe.blur != BLUR_DEFAULT:
+        radius += recipe.blur * scale
+    if recipe.contrast != CONTRAST_DEFAULT:
+        radius += recipe.contrast * scale
+    return halo_for_radius(radius)
+
+
+def offset_matrix(matrix: list[float], left: int, top: int) -> tuple[float, ...]:
+    """
+    Get the AFFINE coefficients rendering the part of a transform starting at
+    the given output pixel.
+
+    Pillow's nearest-neighbour transform steps through rotated images in 16.16
+    fixed point, from the first output pixel: the coefficients start exactly
+    where the whole transform reaches the pixel, so that the part picks the
+    same source pixels.
+
+    Args:
+        matrix (list[float]): AFFINE coefficients of the whole transform.
+        left (int): Column of the first output pixel of the part.
+        top (int): Row of the first output pixel of the part.
+
+    Returns:
+        tuple[float, ...]: AFFINE coefficients of the part.
+    """
+    a, b, c, d, e, f = matrix
+    if b == 0 and d == 0:
+        # Pillow scales without fixed point when the transform does not rotate
+        return (a, b, a * left + c, d, e, e * top + f)
+
+    def fixed(value: float) -> int:
+        return math.floor(value * 65536.0 + 0.5)
+
+    x = fixed(c + a * 0.5 + b * 0.5) + left * fixed(a) + top * fixed(b)
+    y = fixed(f + d * 0.5 + e * 0.5) + left * fixed(d) + top * fixed(e)
+    return (a, b, x / 65536.0 - a * 0.5 - b * 0.5, d, e, y / 65536.0 - d * 0.5 - e * 0.5)
+
+
+def four_color_palette(image: Image.Image, recipe: EditRecipe, scale: float = 1.0) -> Image.Image:
+    """
+    Compute the palette of the 4-color filter from the sample of the stages
+    preceding it, without rendering them on the whole image.
+
+    Args:
+        image (Image.Image): The source image.
+        recipe (EditRecipe): The edit values.
+        scale (float, optional): Scale of the source relative to the original.
+        Defaults to 1.0.
+
+    Returns:
+        Image.Image: A palette image, for ``quantize.map_to_palette``.
+    """
+    output_size, matrix = geometry_transform(
+        image.size, recipe.rotation, recipe.zoom, recipe.flip, scale
+    )
+    size = sample_size(output_size)
+    sample = Image.new(image.mode, size)
+    for y, row in enumerate(_nearest_indices(output_size[1], size[1])):
+        # The geometry stage on one row, keeping the columns of the sample
+        strip = image.transform(
+            (output_size[0], 1), Image.AFFINE, offset_matrix(matrix, 0, row), Image.NEAREST,
+        )
+        sample.paste(strip.resize((size[0], 1), Image.NEAREST), (0, y))
+
+    # The color stage is per pixel, it gives the same pixels on the sample
+    editor = ImageEditor(sample, scale)
+    for method, field_names in EDIT_STAGES:
+        if method == 'four_color_filter':
+            break
+        if method == 'geometry':
+            continue
+        try:
+            getattr(editor, method)(*(getattr(recipe, name) for name in field_names))
+        except OSError:
+            pass
+    return compute_palette(editor.get_image_output, 4, QUANTIZE_METHOD)
+
+
+def _nearest_indices(length: int, sample_length: int) -> list[int]:
+    # Indices of the pixels Image.resize picks along an axis, with Image.NEAREST
+    indices = Image.fromarray(np.arange(length, dtype=np.int32).reshape(length, 1))
+    return np.asarray(indices.resize((1, sample_length), Image.NEAREST)).ravel().tolist()
+
+
+def iter_tiles(image: Image.Image, recipe: EditRecipe, tile_size: int = TILE_SIZE,
+               scale: float = 1.0, failed_stages: set = None
+               ) -> Iterator[tuple[tuple[int, int], Image.Image]]:
+    """
+    Edit an image tile by tile, e.g. to write the result progressively.
+
+    Args:
+        image (Image.Image): The source image.
+        recipe (EditRecipe): The edit values.
+        tile_size (int, optional): Width and height of the tiles. Defaults to
+        ``TILE_SIZE``.
+        scale (float, optional): Scale of the source relative to the original.
+        Defaults to 1.0.
+        failed_stages (set, optional): Receives the stages that could not be
+        applied, as ``ImageEditor.failed_stages``.
+
+    Yields:
+        tuple[tuple[int, int], Image.Image]: Position of each edited tile in the
+        edited image, and the tile, in row-major order.
+    """
+    if image.mode == 'P':
+        image = image.convert('RGB')
+    output_size, matrix = geometry_transform(
+        image.size, recipe.rotation, recipe.zoom, recipe.flip, scale
+    )
+    halo = halo_size(recipe, scale)
+    palette = four_color_palette(image, recipe, scale) if recipe.four_color else None
+
+    for top in range(0, output_size[1], tile_size):
+        for left in range(0, output_size[0], tile_size):
+            # Tile with its halo, clipped to the edited image like the filters
+            box = (
+                max(0, left - halo), max(0, top - halo),
+                min(output_size[0], left + tile_size + halo),
+                min(output_size[1], top + tile_size + halo),
+            )
+            tile = image.transform(
+                (box[2] - box[0], box[3] - box[1]), Image.AFFINE,
+                offset_matrix(matrix, box[0], box[1]), Image.NEAREST,
+            )
+
+            editor = ImageEditor(tile, scale)
+            for method, field_names in EDIT_STAGES:
+                if method == 'geometry':
+                    continue
+                try:
+                    if method == 'four_color_filter':
+                        if palette is not None:
+                            editor.used_image = map_to_palette(
+                                editor.used_image, palette, QUANTIZE_DITHER
+                            )
+                    elif method == 'blur':
+                        editor.blur(recipe.blur, 'gaussian')
+                    else:
+                        getattr(editor, method)(*(getattr(recipe, name) for name in field_names))
+                except OSError:
+                    if failed_stages is not None:
+                        failed_stages.add(method)
+
+            tile = editor.get_image_output.crop((
+                left - box[0], top - box[1],
+                min(output_size[0], left + tile_size) - box[0],
+                min(output_size[1], top + tile_size) - box[1],
+            ))
+            yield (left, top), tile
+
+
+def render_tiled(image: Image.Image, recipe: EditRecipe, tile_size: int = TILE_SIZE,
+                 scale: float = 1.0) -> tuple[Image.Image, list[str]]:
+    """
+    Edit an image tile by tile, and assemble the edited tiles.
+
+    Args:
+        image (Image.Image): The source image.
+        recipe (EditRecipe): The edit values.
+        tile_size (int, optional): Width and height of the tiles. Defaults to
+        ``TILE_SIZE``.
+        scale (float, optional): Scale of the source relative to the original.
+        Defaults to 1.0.
+
+    Returns:
+        tuple[Image.Image, list[str]]: The edited image, and the stages that
+        could not be applied, in ``EDIT_STAGES`` order.
+    """
+    failed_stages = set()
+    output = None
+    output_size, _ = geometry_transform(image.size, recipe.rotation, recipe.zoom, recipe.flip, scale)
+    for position, tile in iter_tiles(image, recipe, tile_size, scale, failed_stages):
+        if output is None:
+            output = Image.new(tile.mode, output_size)
+        output.paste(tile, position)
+    if output is None:
+        output = Image.new(image.mode, output_size)
+    return output, [method for method, _ in EDIT_STAGES if method in failed_stages]